@@ -0,0 +1,107 @@
+"""Print EXPLAIN plans for the hot queries with and without the composite indexes.
+
+The "before" plan is taken inside a transaction that restores the schema from
+before migration 3f2a9c7d41b6 (drops the indexes it added, recreates the ones
+it dropped) and is rolled back afterwards. DROP INDEX takes an ACCESS
+EXCLUSIVE lock on the table for that transaction, so run this against a
+staging copy, not production.
+
+    python benchmarks/explain_hot_queries.py [--analyze]
+"""
+import argparse
+import os
+import sys
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from duolingo_app.config import DB_URL  # noqa: E402
+
+
+NEW_INDEXES = [
+    'ix_message_group_id_id',
+    'ix_group_people_user_id_group_id',
+    'ix_history_user_id_created_at',
+    'ix_user_progress_user_id_completed',
+    'ix_users_active_id',
+]
+
+# single-column indexes the migration dropped, as they were created before it
+OLD_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_message_group_id ON message (group_id)',
+    'CREATE INDEX IF NOT EXISTS ix_group_people_user_id ON group_people (user_id)',
+    'CREATE INDEX IF NOT EXISTS ix_history_user_id ON history (user_id)',
+    'CREATE INDEX IF NOT EXISTS ix_user_progress_user_id ON user_progress (user_id)',
+]
+
+# (label, sql, sql that picks a realistic parameter set)
+HOT_QUERIES = [
+    ('fetch_messages latest page',
+     'SELECT * FROM message WHERE group_id = :group_id ORDER BY id DESC LIMIT 50',
+     'SELECT group_id FROM message GROUP BY group_id ORDER BY count(*) DESC LIMIT 1'),
+    ('fetch_messages older page',
+     'SELECT * FROM message WHERE group_id = :group_id AND id < :before_id ORDER BY id DESC LIMIT 50',
+     'SELECT group_id, max(id) / 2 AS before_id FROM message GROUP BY group_id ORDER BY count(*) DESC LIMIT 1'),
+    ('is_member',
+     'SELECT id FROM group_people WHERE group_id = :group_id AND user_id = :user_id',
+     'SELECT group_id, user_id FROM group_people LIMIT 1'),
+    ('group_member_ids',
+     'SELECT user_id FROM group_people WHERE group_id = :group_id',
+     'SELECT group_id FROM group_people GROUP BY group_id ORDER BY count(*) DESC LIMIT 1'),
+    ('list_groups for user',
+     'SELECT chat_group.* FROM chat_group JOIN group_people ON group_people.group_id = chat_group.id '
+     'WHERE group_people.user_id = :user_id ORDER BY chat_group.id DESC',
+     'SELECT user_id FROM group_people GROUP BY user_id ORDER BY count(*) DESC LIMIT 1'),
+    ('history per user by time',
+     'SELECT * FROM history WHERE user_id = :user_id AND created_at >= now() - interval \'30 days\' '
+     'ORDER BY created_at',
+     'SELECT user_id FROM history GROUP BY user_id ORDER BY count(*) DESC LIMIT 1'),
+    ('completed progress per user',
+     'SELECT * FROM user_progress WHERE user_id = :user_id AND completed',
+     'SELECT user_id FROM user_progress GROUP BY user_id ORDER BY count(*) DESC LIMIT 1'),
+    ('active users page',
+     'SELECT * FROM users WHERE is_active AND id > :after_id ORDER BY id LIMIT 50',
+     'SELECT coalesce(min(id), 0) AS after_id FROM users'),
+]
+
+
+def explain(conn, sql, params, analyze):
+    options = 'ANALYZE, BUFFERS' if analyze else 'COSTS'
+    rows = conn.execute(text(f'EXPLAIN ({options}) {sql}'), params)
+    return '\n'.join('    ' + r[0] for r in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--analyze', action='store_true', help='run EXPLAIN ANALYZE (executes the queries)')
+    args = parser.parse_args()
+
+    engine = create_engine(DB_URL)
+    with engine.connect() as conn:
+        with conn.begin():
+            present = set(conn.scalars(text(
+                'SELECT indexname FROM pg_indexes WHERE indexname = ANY(:names)'), {'names': NEW_INDEXES}))
+        for label, sql, param_sql in HOT_QUERIES:
+            with conn.begin():
+                row = conn.execute(text(param_sql)).mappings().first()
+            if row is None:
+                print(f'== {label}: no data, skipped\n')
+                continue
+            params = dict(row)
+            print(f'== {label} {params}')
+
+            trans = conn.begin()
+            for name in present:
+                conn.execute(text(f'DROP INDEX {name}'))
+            for ddl in OLD_INDEXES:
+                conn.execute(text(ddl))
+            print('  before:\n' + explain(conn, sql, params, args.analyze))
+            trans.rollback()
+
+            with conn.begin():
+                print('  after:\n' + explain(conn, sql, params, args.analyze))
+            print()
+
+
+if __name__ == '__main__':
+    main()
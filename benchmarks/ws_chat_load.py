@@ -0,0 +1,336 @@
+"""Load-test the /ws/chat socket: fan-out latency, throughput and cost per message.
+
+Starts the app with uvicorn against the configured database (or a throwaway
+SQLite file with --sqlite, which needs aiosqlite installed), registers and
+logs in --clients users, opens one authenticated socket per user, creates
+--groups groups through the chat actions and then sends messages at --rate
+per second for --duration seconds from randomly chosen members. Every
+member's socket timestamps the copy it receives, so latency covers the whole
+path: send, membership check, group commit, fan-out and delivery.
+
+Reported: delivery latency percentiles, sent/delivered throughput, lost
+deliveries, server RSS per open socket and SQL statements per message (both
+read from the server process, so only with --workers 1). The same --seed
+gives the same groups, senders and send schedule, so runs can be compared
+before and after a ConnectManager change:
+
+    python benchmarks/ws_chat_load.py --clients 500 --groups 50 --rate 200 --duration 30 --json before.json
+    python benchmarks/ws_chat_load.py --sqlite --clients 50 --format msgpack
+    python benchmarks/ws_chat_load.py --url http://127.0.0.1:8003 --clients 200
+
+Users are named bench_<n> and reused between runs against the same database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+import msgpack
+from websockets.asyncio.client import connect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'bench-password'
+
+
+def http(base: str, method: str, path: str, body: Optional[dict] = None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(base + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return response.status, json.loads(response.read() or b'null')
+    except urllib.error.HTTPError as exc:
+        return exc.code, json.loads(exc.read() or b'null')
+
+
+async def ahttp(base: str, method: str, path: str, body: Optional[dict] = None):
+    return await asyncio.to_thread(http, base, method, path, body)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class Client:
+    def __init__(self, index: int, token: str, fmt: str, latencies: List[float]) -> None:
+        self.index = index
+        self.token = token
+        self.fmt = fmt
+        self.latencies = latencies
+        self.user_id: Optional[int] = None
+        self.replies: 'asyncio.Queue[dict]' = asyncio.Queue()
+        self.ws = None
+        self.reader: Optional[asyncio.Task] = None
+
+    def encode(self, payload: dict):
+        return msgpack.packb(payload) if self.fmt == 'msgpack' else json.dumps(payload)
+
+    def decode(self, frame) -> dict:
+        return msgpack.unpackb(frame) if isinstance(frame, bytes) else json.loads(frame)
+
+    async def open(self, ws_base: str) -> None:
+        subprotocols = ['msgpack'] if self.fmt == 'msgpack' else None
+        self.ws = await connect(f'{ws_base}/ws/chat?token={self.token}', subprotocols=subprotocols,
+                                max_size=None, open_timeout=60)
+        hello = self.decode(await self.ws.recv())
+        if hello.get('event') != 'connected':
+            raise RuntimeError(f'client {self.index}: {hello}')
+        self.user_id = hello['user_id']
+        self.reader = asyncio.get_running_loop().create_task(self.read())
+
+    async def read(self) -> None:
+        async for frame in self.ws:
+            event = self.decode(frame)
+            if event.get('event') == 'message' and event['message']['text'].startswith('bench '):
+                sent_at = float(event['message']['text'].split()[2])
+                self.latencies.append(time.perf_counter() - sent_at)
+            else:
+                self.replies.put_nowait(event)
+
+    async def request(self, payload: dict, event: str) -> dict:
+        await self.ws.send(self.encode(payload))
+        while True:
+            reply = await asyncio.wait_for(self.replies.get(), 60)
+            if reply.get('event') == event:
+                return reply
+            if reply.get('event') == 'error':
+                raise RuntimeError(f'client {self.index} {payload["action"]}: {reply}')
+
+    async def send_message(self, group_id: int, seq: int) -> None:
+        text = f'bench {seq} {time.perf_counter():.9f}'
+        await self.ws.send(self.encode({'action': 'send_message', 'group_id': group_id, 'text': text}))
+
+    async def close(self) -> None:
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            self.reader.cancel()
+
+
+def prepare_sqlite(path: str) -> Dict[str, str]:
+    env = {'DB_URL': f'sqlite:///{path}', 'ASYNC_DB_URL': f'sqlite+aiosqlite:///{path}'}
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import create_engine
+    from duolingo_app.database import models  # noqa: F401  (registers the tables)
+    from duolingo_app.database.db import Base
+
+    engine = create_engine(env['DB_URL'])
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return env
+
+
+def start_server(args, env: Dict[str, str]) -> subprocess.Popen:
+    cmd = [sys.executable, '-m', 'uvicorn', 'main:duolingo_app', '--host', '127.0.0.1', '--port', str(args.port),
+           '--workers', str(args.workers), '--log-level', 'warning']
+    # every bench user registers and logs in from this one address
+    server = subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, 'RATE_LIMIT_ENABLED': 'false', **env})
+    base = f'http://127.0.0.1:{args.port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f'server exited with {server.returncode}')
+        try:
+            if http(base, 'GET', '/metrics/')[0] == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise SystemExit('server did not start within 60s')
+
+
+async def login_all(base: str, count: int, concurrency: int) -> List[str]:
+    limit = asyncio.Semaphore(concurrency)
+
+    async def login(n: int) -> str:
+        username = f'bench_{n}'
+        async with limit:
+            status, body = await ahttp(base, 'POST', '/auth/login/', {'username': username, 'password': PASSWORD})
+            if status == 401:
+                await ahttp(base, 'POST', '/auth/register/', {
+                    'username': username, 'first_name': 'Bench', 'last_name': str(n),
+                    'email': f'{username}@bench.example.com', 'password': PASSWORD})
+                status, body = await ahttp(base, 'POST', '/auth/login/', {'username': username, 'password': PASSWORD})
+            if status != 200:
+                raise RuntimeError(f'login {username}: {status} {body}')
+            return body['access_token']
+
+    return await asyncio.gather(*(login(n) for n in range(count)))
+
+
+async def create_groups(base: str, clients: List[Client], group_count: int, run_id: str,
+                        members_via: str) -> Dict[int, List[Client]]:
+    groups: Dict[int, List[Client]] = {}
+    for g in range(group_count):
+        members = clients[g::group_count]
+        if not members:
+            continue
+        owner = members[0]
+        reply = await owner.request({'action': 'create_group', 'name': f'bench-{run_id}-{g}'}, 'group_created')
+        group_id = reply['group']['id']
+        others = [c.user_id for c in members[1:]]
+        if others and members_via == 'ws':
+            await owner.request({'action': 'add_members', 'group_id': group_id, 'user_ids': others}, 'members added')
+        elif others:
+            # add_members is Postgres-only (= ANY(int[])); SQLite goes through the REST endpoint
+            for user_id in others:
+                await ahttp(base, 'POST', '/people/', {'group_id': group_id, 'user_id': user_id})
+        groups[group_id] = members
+    return groups
+
+
+async def run(args) -> dict:
+    env: Dict[str, str] = {}
+    server = None
+    if args.sqlite:
+        env = prepare_sqlite(os.path.join(tempfile.mkdtemp(prefix='ws_bench_'), 'bench.db'))
+    if args.url:
+        base = args.url.rstrip('/')
+    else:
+        server = start_server(args, env)
+        base = f'http://127.0.0.1:{args.port}'
+    ws_base = 'ws' + base[len('http'):]
+    track_server = server is not None and args.workers == 1
+
+    try:
+        rng = random.Random(args.seed)
+        started = time.perf_counter()
+        tokens = await login_all(base, args.clients, args.login_concurrency)
+        print(f'logged in {len(tokens)} users in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+        latencies: List[float] = []
+        clients = [Client(n, token, args.format, latencies) for n, token in enumerate(tokens)]
+        rss_before = rss_bytes(server.pid) if track_server else None
+        limit = asyncio.Semaphore(args.connect_concurrency)
+
+        async def open_client(client: Client) -> None:
+            async with limit:
+                await client.open(ws_base)
+
+        await asyncio.gather(*(open_client(c) for c in clients))
+        await asyncio.sleep(0.5)
+        rss_after = rss_bytes(server.pid) if track_server else None
+
+        run_id = f'{args.seed}-{int(time.time())}'
+        members_via = args.members_via or ('rest' if args.sqlite else 'ws')
+        groups = await create_groups(base, clients, args.groups, run_id, members_via)
+        group_of = {c.index: group_id for group_id, members in groups.items() for c in members}
+        print(f'{len(clients)} sockets, {len(groups)} groups', file=sys.stderr)
+
+        # open-loop schedule: the n-th message leaves at start + n / rate
+        total = int(args.rate * args.duration)
+        senders = [rng.randrange(len(clients)) for _ in range(total)]
+        expected = sum(len(groups[group_of[s]]) for s in senders)
+        for client in clients:
+            while not client.replies.empty():
+                client.replies.get_nowait()
+        latencies.clear()
+
+        _, metrics_before = await ahttp(base, 'GET', '/metrics/')
+        loop = asyncio.get_running_loop()
+        pending = set()
+        start = loop.time()
+        for seq, sender in enumerate(senders):
+            delay = start + seq / args.rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            client = clients[sender]
+            task = loop.create_task(client.send_message(group_of[sender], seq))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        send_seconds = loop.time() - start
+        if pending:
+            await asyncio.gather(*pending)
+
+        deadline = loop.time() + args.drain
+        while len(latencies) < expected and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = loop.time() - start
+        _, metrics_after = await ahttp(base, 'GET', '/metrics/')
+
+        await asyncio.gather(*(c.close() for c in clients))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    ordered = sorted(latencies)
+    statements = metrics_after['db_statements_total'] - metrics_before['db_statements_total']
+    batches = metrics_after.get('chat_write_batch_rows', {})
+    batches_before = metrics_before.get('chat_write_batch_rows', {})
+    batch_count = batches.get('count', 0) - batches_before.get('count', 0)
+    return {
+        'config': {k: v for k, v in vars(args).items() if k not in ('url',)},
+        'messages_sent': total,
+        'send_rate': round(total / send_seconds, 1) if send_seconds else None,
+        'deliveries_expected': expected,
+        'deliveries': len(latencies),
+        'deliveries_lost': expected - len(latencies),
+        'deliveries_per_second': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(ordered, 50) * 1000, 2),
+            'p90': round(percentile(ordered, 90) * 1000, 2),
+            'p99': round(percentile(ordered, 99) * 1000, 2),
+            'max': round(ordered[-1] * 1000, 2) if ordered else None,
+        },
+        'rss_per_socket_kib': (round((rss_after - rss_before) / len(clients) / 1024, 1)
+                               if rss_before is not None and rss_after is not None else None),
+        # with several workers /metrics is answered by one of them
+        'statements_per_message': round(statements / total, 2) if total and track_server else None,
+        'write_batch_rows_avg': (round((batches['sum'] - batches_before.get('sum', 0)) / batch_count, 1)
+                                 if batch_count else None),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='benchmark a running server instead of starting one')
+    parser.add_argument('--sqlite', action='store_true', help='start the server on a throwaway SQLite database')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=50, help='messages per second, all senders together')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of sending')
+    parser.add_argument('--drain', type=float, default=10, help='seconds to wait for outstanding deliveries')
+    parser.add_argument('--format', choices=('json', 'msgpack'), default='json')
+    parser.add_argument('--members-via', choices=('ws', 'rest'), help='default: ws, or rest with --sqlite')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--login-concurrency', type=int, default=8)
+    parser.add_argument('--connect-concurrency', type=int, default=100)
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.json_path:
+        with open(args.json_path, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,34 @@
+import hashlib
+import logging
+import secrets
+import time
 from fastapi import APIRouter, HTTPException, Depends
+from duolingo_app import metrics
+from duolingo_app.cache import TTLCache
 from duolingo_app.database.models import UserProfile, RefreshToken
 from duolingo_app.database.schema import  UserProfileInputSchema, UserLoginSchema
-from duolingo_app.database.db import  SessionLocal
+from duolingo_app.database.db import  get_db
+from duolingo_app.passwords import hash_password, verify_password
+from sqlalchemy import delete, event, or_, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
-from duolingo_app.config import (SECRET_KEY, ALGORITHM, ACCESS_TOKEN_LIFETIME, REFRESH_TOKEN_LIFETIME)
+from duolingo_app.config import (SECRET_KEY, ALGORITHM, ACCESS_TOKEN_LIFETIME, REFRESH_TOKEN_LIFETIME,
+                                 AUTH_CLAIMS_CACHE_SIZE, AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL)
 from datetime import timedelta, datetime
-from jose import jwt
-from typing import Optional
+from jose import jwt, JWTError
+from typing import NamedTuple, Optional
 
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 oauth2_schema = OAuth2PasswordBearer(tokenUrl='/auth/login')
+logger = logging.getLogger('duolingo_app.auth')
+refresh_reuse = metrics.counter('auth_refresh_reuse_total')
 
 
 auth_router = APIRouter(prefix='/auth', tags=['Auth'])
 
-async def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def verify_password(plain_password, hashed_password):
-        return pwd_context.verify(plain_password, hashed_password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_LIFETIME))
@@ -38,14 +36,110 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def create_refresh_token(data: dict):
+    # jti keeps two tokens issued within the same second distinct
+    data = {**data, 'jti': secrets.token_urlsafe(16)}
     return create_access_token(data, expires_delta=timedelta(days=REFRESH_TOKEN_LIFETIME))
 
+
+def taken_field(exc: IntegrityError) -> str:
+    """Which unique column of ``users`` an insert collided with."""
+    # asyncpg reports the violated index; the message text also holds the
+    # colliding value, so a username like "email_fan" must not be matched on
+    constraint = getattr(exc.orig.__cause__, 'constraint_name', None)
+    if constraint is not None:
+        return 'email address' if constraint == 'ix_users_email' else 'username'
+    # sqlite: "UNIQUE constraint failed: users.email"
+    return 'email address' if 'users.email' in str(exc.orig) else 'username'
+
+
+def token_digest(token: str) -> str:
+    # tokens are signed and random enough that an unsalted hash cannot be reversed
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class AuthUser(NamedTuple):
+    id: int
+    username: str
+
+
+# decoded claims per token string, kept until the token's exp
+claims_cache = TTLCache('auth_claims', AUTH_CLAIMS_CACHE_SIZE)
+# user id -> AuthUser of an active user; invalidated when a session commits
+# changes to that user, other workers see the change within the ttl
+user_cache = TTLCache('auth_user', AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL)
+
+
+def decode_token(token: str) -> dict:
+    claims = claims_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        claims_cache.set(token, claims, ttl=claims.get('exp', 0) - time.time())
+    return claims
+
+
+async def user_from_token(db: AsyncSession, token: str) -> AuthUser:
+    """The active user a token belongs to; ValueError if there is none.
+
+    Tokens carry the user id in ``uid``, so a warm cache answers without
+    touching the database. Older tokens only have ``sub`` (the username).
+    """
+    try:
+        claims = decode_token(token)
+    except JWTError:
+        raise ValueError('Invalid token')
+    uid, username = claims.get('uid'), claims.get('sub')
+    if uid is None and not username:
+        raise ValueError('Invalid token')
+
+    user = user_cache.get(uid) if uid is not None else None
+    if user is not None:
+        return user
+
+    stmt = select(UserProfile.id, UserProfile.username).where(UserProfile.is_active)
+    stmt = stmt.where(UserProfile.id == uid) if uid is not None else stmt.where(UserProfile.username == username)
+    row = (await db.execute(stmt)).first()
+    if row is None:
+        raise ValueError('User not found')
+    user = AuthUser(row.id, row.username)
+    user_cache.set(user.id, user)
+    return user
+
+
+async def get_current_user(token: str = Depends(oauth2_schema), db: AsyncSession = Depends(get_db)) -> AuthUser:
+    try:
+        return await user_from_token(db, token)
+    except ValueError as exc:
+        raise HTTPException(detail=str(exc), status_code=401, headers={'WWW-Authenticate': 'Bearer'})
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_user_changes(session, flush_context):
+    changed = session.info.setdefault('auth_user_changes', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, UserProfile):
+            changed.add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_users(session):
+    for user_id in session.info.pop('auth_user_changes', ()):
+        user_cache.pop(user_id)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _forget_user_changes(session, transaction):
+    # not on a SAVEPOINT rollback, the changes before it are still committed
+    if transaction.parent is None:
+        session.info.pop('auth_user_changes', None)
+
 @auth_router.post('/register/', response_model=dict)
-async def register(user: UserProfileInputSchema, db: Session = Depends(get_db)):
-    user_db = db.query(UserProfile).filter(UserProfile.username==user.username).first()
-    email_db = db.query(UserProfile).filter(UserProfile.email==user.email).first()
-    if user_db or email_db:
-        raise HTTPException(detail='such username or email address', status_code=400)
+async def register(user: UserProfileInputSchema, db: AsyncSession = Depends(get_db)):
+    taken = (await db.scalars(select(UserProfile.username).where(
+        or_(UserProfile.username == user.username, UserProfile.email == user.email)))).all()
+    if taken:
+        field = 'username' if user.username in taken else 'email address'
+        raise HTTPException(detail=f'such {field} already exists', status_code=400)
+    password = await hash_password(user.password)
     user_date = UserProfile(
         first_name=user.first_name,
         last_name=user.last_name,
@@ -53,57 +147,87 @@ async def register(user: UserProfileInputSchema, db: Session = Depends(get_db)):
         email=user.email,
         age=user.age,
         phone_number=user.phone_number,
-        password= get_password_hash(user.password)
+        password=password
 
     )
     db.add(user_date)
-    db.commit()
-    db.refresh(user_date)
+    try:
+        await db.commit()
+    except IntegrityError as exc:
+        # a concurrent sign-up got there between the check and the insert
+        await db.rollback()
+        raise HTTPException(detail=f'such {taken_field(exc)} already exists', status_code=400)
 
     return {'message': 'registered'}
 
 @auth_router.post('/login/', response_model=dict)
-async def login(user:UserLoginSchema, db: Session = Depends(get_db)):
-    user_db = db.query(UserProfile).filter(UserProfile.username == user.username).first()
-    if not user_db or not verify_password(user.password, user_db.password):
+async def login(user:UserLoginSchema, db: AsyncSession = Depends(get_db)):
+    user_db = await db.scalar(select(UserProfile).where(UserProfile.username == user.username))
+    if not user_db:
         raise HTTPException(detail='No such Username or password', status_code=401)
+    verified, new_hash = await verify_password(user.password, user_db.password)
+    if not verified:
+        raise HTTPException(detail='No such Username or password', status_code=401)
+    if new_hash:
+        # stored with an outdated bcrypt cost; saved with the token below
+        user_db.password = new_hash
 
-    access_token = create_access_token({'sub': user_db.username})
-    refresh_token = create_refresh_token({'sub': user_db.username})
+    access_token = create_access_token({'sub': user_db.username, 'uid': user_db.id})
+    refresh_token = create_refresh_token({'sub': user_db.username, 'uid': user_db.id})
 
-    token_db = db.query(RefreshToken).filter(RefreshToken.user_id == user_db.id).first()
-    if token_db:
-        token_db.token = refresh_token
-    else:
-        token_db = RefreshToken(user_id=user_db.id, token=refresh_token)
-        db.add(token_db)
+    # one session per user: a new login ends the previous token family
+    await db.execute(delete(RefreshToken).where(RefreshToken.user_id == user_db.id))
+    db.add(RefreshToken(user_id=user_db.id, token_hash=token_digest(refresh_token), family=secrets.token_hex(16)))
 
-    db.commit()
+    await db.commit()
 
     return {'access_token': access_token, 'refresh_token': refresh_token, 'token_type': 'Bearer'}
 
 
 @auth_router.post('/logout/')
-async def logout(refresh_token: str, db: Session = Depends(get_db)):
-    stored_token = db.query(RefreshToken).filter(RefreshToken.token == refresh_token).first()
+async def logout(refresh_token: str, db: AsyncSession = Depends(get_db)):
+    family = select(RefreshToken.family).where(RefreshToken.token_hash == token_digest(refresh_token))
+    result = await db.execute(delete(RefreshToken).where(RefreshToken.family == family.scalar_subquery()))
 
-    if not stored_token:
+    if not result.rowcount:
         raise HTTPException(detail='Incorrect information', status_code=401)
 
-    db.delete(stored_token)
-    db.commit()
+    await db.commit()
 
     return {'message': ' Вышли'}
 
 
 @auth_router.post("/refresh", response_model=dict)
-async def refresh(refresh_token: str, db: Session = Depends(get_db)):
-    stored_token = db.query(RefreshToken).filter(RefreshToken.token == refresh_token).first()
+async def refresh(refresh_token: str, db: AsyncSession = Depends(get_db)):
+    """Exchange a refresh token for an access token and the next refresh token.
 
-    if not stored_token:
+    Every refresh token works once. Presenting one that was already exchanged
+    means it leaked (or the client raced itself), so its whole family is
+    revoked and the user has to log in again.
+    """
+    try:
+        user = await user_from_token(db, refresh_token)
+    except ValueError:
         raise HTTPException(status_code=401, detail="Incorrect Information")
 
+    digest = token_digest(refresh_token)
+    # claim the token atomically, so two concurrent refreshes cannot both succeed
+    family = await db.scalar(
+        update(RefreshToken).where(RefreshToken.token_hash == digest, RefreshToken.used.is_(False))
+        .values(used=True).returning(RefreshToken.family))
+
+    if family is None:
+        reused = await db.scalar(select(RefreshToken.family).where(RefreshToken.token_hash == digest))
+        if reused is not None:
+            refresh_reuse.inc()
+            logger.warning('refresh token reused, revoking family of user %s', user.id)
+            await db.execute(delete(RefreshToken).where(RefreshToken.family == reused))
+            await db.commit()
+        raise HTTPException(status_code=401, detail="Incorrect Information")
 
-    access_token = create_access_token({"sub": stored_token.user.username if hasattr(stored_token, "user") else str(stored_token.user_id)})
+    access_token = create_access_token({"sub": user.username, "uid": user.id})
+    new_refresh_token = create_refresh_token({"sub": user.username, "uid": user.id})
+    db.add(RefreshToken(user_id=user.id, token_hash=token_digest(new_refresh_token), family=family))
+    await db.commit()
 
-    return {"access_token": access_token, "token_type": "Bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "refresh_token": new_refresh_token, "token_type": "Bearer"}
\ No newline at end of file
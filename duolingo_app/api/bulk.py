@@ -0,0 +1,90 @@
+from typing import Any, Dict, List, Sequence, Tuple, Type
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from duolingo_app.config import BULK_MAX_ROWS
+
+
+async def bulk_write(
+    db: AsyncSession,
+    model: Type,
+    schema: Type[BaseModel],
+    rows: List[Dict[str, Any]],
+    parents: Dict[str, Type],
+    conflict: Sequence[str] = (),
+    update: Sequence[str] = (),
+) -> dict:
+    """Validate ``rows`` and write the good ones in one multi-row INSERT.
+
+    ``parents`` maps a foreign key column to its model so missing parents are
+    reported per row instead of failing the whole statement. With
+    ``conflict`` the insert becomes an upsert on that unique key, updating
+    the ``update`` columns.
+    """
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(detail=f'At most {BULK_MAX_ROWS} rows per request', status_code=413)
+
+    errors: List[dict] = []
+    valid: List[Tuple[int, dict]] = []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, schema.model_validate(row).model_dump()))
+        except ValidationError as exc:
+            errors.append({'index': index, 'detail': exc.errors(include_url=False, include_context=False)})
+
+    for column, parent in parents.items():
+        ids = {row[column] for _, row in valid}
+        found = set(await db.scalars(select(parent.id).where(parent.id.in_(ids)))) if ids else set()
+        kept = []
+        for index, row in valid:
+            if row[column] in found:
+                kept.append((index, row))
+            else:
+                errors.append({'index': index, 'detail': f'{column}={row[column]} does not exist'})
+        valid = kept
+
+    if conflict:
+        # one statement cannot upsert the same key twice, so the last row wins
+        by_key: Dict[tuple, Tuple[int, dict]] = {}
+        for index, row in valid:
+            key = tuple(row[c] for c in conflict)
+            if key in by_key:
+                errors.append({'index': by_key[key][0], 'detail': f'overridden by row {index}'})
+            by_key[key] = (index, row)
+        valid = sorted(by_key.values(), key=lambda item: item[0])
+
+    errors.sort(key=lambda e: e['index'])
+    if not valid:
+        return {'items': [], 'errors': errors}
+
+    stmt = insert(model)
+    if conflict:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(conflict),
+            set_={c: stmt.excluded[c] for c in update},
+        )
+    stmt = stmt.returning(model, sort_by_parameter_order=True)
+    try:
+        result = await db.scalars(stmt, [row for _, row in valid], execution_options={'populate_existing': True})
+        items = result.all()
+    except IntegrityError:
+        # some row breaks a constraint the checks above do not cover (a
+        # unique key other than ``conflict``, a parent deleted meanwhile):
+        # redo the batch row by row so only those rows are reported
+        await db.rollback()
+        items = []
+        for index, row in valid:
+            try:
+                async with db.begin_nested():
+                    item = await db.scalar(stmt, row, execution_options={'populate_existing': True})
+            except IntegrityError:
+                errors.append({'index': index, 'detail': 'conflicts with existing data'})
+            else:
+                items.append(item)
+        errors.sort(key=lambda e: e['index'])
+    await db.commit()
+
+    return {'items': items, 'errors': errors}
@@ -1,10 +1,23 @@
-from typing import Dict, Set, List, Optional, Any
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
-from jose import jwt, JWTError
-from sqlalchemy.orm import Session
-from duolingo_app.database.db import SessionLocal
+from sqlalchemy import DateTime, Integer, any_, bindparam, delete, exists, func, literal, select, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from duolingo_app.database.db import AsyncSessionLocal
+from duolingo_app.database import query_stats
 from duolingo_app.database.models import UserProfile, ChatMessage, ChatGroup, GroupPeople
-from duolingo_app.config import SECRET_KEY, ALGORITHM
+from duolingo_app import metrics
+from duolingo_app.broker import Broker, create_broker
+from duolingo_app.chat_codec import Codec, Frame, negotiate, receive, send_frame
+from duolingo_app.message_writer import message_writer
+from duolingo_app.recent_messages import recent_messages
+from duolingo_app.config import (CHAT_MEMBERSHIP_CACHE_SIZE, CHAT_SEND_QUEUE_SIZE,
+                                 CHAT_SLOW_CONSUMER, CHAT_UNREAD_CAP)
+from .auth import AuthUser, user_from_token
 
 
 chat_router = APIRouter(tags=['Chat WS'])
@@ -22,69 +35,221 @@ def _extract_token(websocket: WebSocket, token_q: Optional[str]) -> Optional[str
         return parts[1]
     return None
 
-def get_user_from_token(db: Session, token: str) -> UserProfile:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get('sub')
-        if not username:
-            raise JWTError('no sub')
-    except JWTError:
-        raise ValueError('Invalid token')
-    user = db.query(UserProfile).filter(UserProfile.username == username).first()
-    if not user:
-        raise ValueError('User not found')
-    return user
+send_dropped = metrics.counter('chat_send_dropped_total')
+slow_disconnects = metrics.counter('chat_slow_consumer_disconnects_total')
 
 
-class ConnectManager:
-    def __init__(self) -> None:
-        self._connections: Dict[int, Set[WebSocket]] = {}
+class Outbox:
+    """Bounded queue of encoded frames for one socket, drained by its own writer task."""
+
+    def __init__(self, user_id: int, websocket: WebSocket, codec: Codec, maxsize: int) -> None:
+        self.user_id = user_id
+        self.websocket = websocket
+        self.codec = codec
+        self.queue: 'asyncio.Queue[Frame]' = asyncio.Queue(maxsize)
+        self.task: Optional['asyncio.Task[None]'] = None
+        self.closed = False
+
+    def put(self, frame: Frame) -> bool:
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            return False
+        return True
+
 
-    async def connect(self, user_id: int, websocket: WebSocket) -> None:
-        await websocket.accept()
-        self._connections.setdefault(user_id, set()).add(websocket)
+class ConnectManager:
+    def __init__(self, membership_cache_size: int = CHAT_MEMBERSHIP_CACHE_SIZE,
+                 queue_size: int = CHAT_SEND_QUEUE_SIZE, slow_consumer: str = CHAT_SLOW_CONSUMER,
+                 broker: Optional[Broker] = None) -> None:
+        self._connections: Dict[int, Dict[WebSocket, Outbox]] = {}
+        self._queue_size = queue_size
+        # 'disconnect' closes a socket whose queue is full, 'drop' skips the frame for it
+        self._slow_consumer = slow_consumer
+        # group_id -> member user ids, least recently used first
+        self._members: 'OrderedDict[int, Set[int]]' = OrderedDict()
+        self._membership_cache_size = membership_cache_size
+        # groups whose members are being read -> whether they changed meanwhile
+        self._loading: Dict[int, bool] = {}
+        # closes of slow sockets still in flight; the loop only keeps weak references
+        self._closing: Set['asyncio.Task[None]'] = set()
+        # other workers' sockets are reached through the broker
+        self.broker = broker or create_broker()
+        self.broker.subscribe(self._on_envelope)
+
+    async def members(self, db: AsyncSession, group_id: int) -> Set[int]:
+        cached = self._members.get(group_id)
+        if cached is not None:
+            self._members.move_to_end(group_id)
+            return cached
+        self._loading.setdefault(group_id, False)
+        try:
+            cached = set(await group_member_ids(db, group_id))
+        except BaseException:
+            self._loading.pop(group_id, None)
+            raise
+        # an invalidation during the read may have removed someone we just
+        # loaded; answer this caller but leave the next one to read again
+        if not self._loading.pop(group_id, True):
+            self._cache_members(group_id, cached)
+        return cached
+
+    async def is_member(self, db: AsyncSession, group_id: int, user_id: int) -> bool:
+        return user_id in await self.members(db, group_id)
+
+    def set_members(self, group_id: int, user_ids: Iterable[int]) -> None:
+        self._forget(group_id)
+        self._cache_members(group_id, set(user_ids))
+
+    def _cache_members(self, group_id: int, user_ids: Set[int]) -> None:
+        self._members[group_id] = user_ids
+        self._members.move_to_end(group_id)
+        if len(self._members) > self._membership_cache_size:
+            self._members.popitem(last=False)
+
+    def _forget(self, group_id: int) -> None:
+        self._members.pop(group_id, None)
+        if group_id in self._loading:
+            self._loading[group_id] = True
+
+    async def invalidate_group(self, group_id: int) -> None:
+        self._forget(group_id)
+        await self.broker.publish({'invalidate': group_id})
+
+    async def connect(self, user_id: int, websocket: WebSocket, codec: Codec) -> None:
+        await self.broker.start()
+        outbox = Outbox(user_id, websocket, codec, self._queue_size)
+        outbox.task = asyncio.create_task(self._writer(user_id, outbox))
+        self._connections.setdefault(user_id, {})[websocket] = outbox
+        # replies go through the same queue, so each socket has one writer and one order
+        websocket.state.outbox = outbox
 
     def disconnect(self, user_id: int, websocket: WebSocket) -> None:
-        if user_id in self._connections:
-            self._connections[user_id].discard(websocket)
-            if not self._connections[user_id]:
-                self._connections.pop(user_id, None)
-
-    async def send_to_user(self, user_id: int, payload: dict) -> None:
-        conns = list(self._connections.get(user_id, []))
-        dead: List[WebSocket] = []
-        for ws in conns:
-            try:
-                await ws.send_json(payload)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.disconnect(user_id, ws)
+        conns = self._connections.get(user_id)
+        if conns is None:
+            return
+        outbox = conns.pop(websocket, None)
+        if not conns:
+            self._connections.pop(user_id, None)
+        if outbox is not None:
+            outbox.closed = True
+            if outbox.task is not None and outbox.task is not asyncio.current_task():
+                outbox.task.cancel()
+
+    def connection_count(self) -> int:
+        return sum(len(conns) for conns in self._connections.values())
+
+    def queue_depth(self) -> int:
+        return sum(o.queue.qsize() for conns in self._connections.values() for o in conns.values())
 
-    async def broadcast_to_users(self, user_ids: List[int], payload: dict) -> None:
-        for uid in set(user_ids):
-            await self.send_to_user(uid, payload)
+    async def _writer(self, user_id: int, outbox: Outbox) -> None:
+        try:
+            while True:
+                frame = await outbox.queue.get()
+                await send_frame(outbox.websocket, frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.disconnect(user_id, outbox.websocket)
+
+    def _overflow(self, user_id: int, outbox: Outbox) -> None:
+        send_dropped.inc()
+        if self._slow_consumer != 'disconnect':
+            return
+        slow_disconnects.inc()
+        self.disconnect(user_id, outbox.websocket)
+        task = asyncio.get_running_loop().create_task(self._close_slow(outbox.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_slow(websocket: WebSocket) -> None:
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def enqueue(self, outbox: Outbox, frame: Frame) -> None:
+        if outbox.closed:
+            return
+        if not outbox.put(frame):
+            self._overflow(outbox.user_id, outbox)
+
+    def send_to_user(self, user_id: int, payload: dict) -> None:
+        self._deliver([user_id], payload)
+
+    def _deliver(self, user_ids: Iterable[int], payload: dict) -> None:
+        # encode once per codec in use; only members with an open socket on
+        # this worker need a send
+        frames: Dict[str, Frame] = {}
+        for uid in self._connections.keys() & set(user_ids):
+            for outbox in list(self._connections.get(uid, {}).values()):
+                frame = frames.get(outbox.codec.name)
+                if frame is None:
+                    frame = frames[outbox.codec.name] = outbox.codec.encode(payload)
+                self.enqueue(outbox, frame)
+
+    async def broadcast_to_users(self, user_ids: Iterable[int], payload: dict) -> None:
+        # enqueue only; the writer tasks do the (possibly slow) socket sends
+        user_ids = list(set(user_ids))
+        self._deliver(user_ids, payload)
+        await self.broker.publish({'user_ids': user_ids, 'payload': payload})
+
+    def _on_envelope(self, envelope: dict) -> None:
+        if 'invalidate' in envelope:
+            self._forget(envelope['invalidate'])
+        elif 'reset' in envelope:
+            self._members.clear()
+            for group_id in self._loading:
+                self._loading[group_id] = True
+            recent_messages.clear()
+        else:
+            payload = envelope['payload']
+            if payload.get('event') == 'message':
+                recent_messages.add(payload['message'])
+            self._deliver(envelope['user_ids'], payload)
+
+    async def close(self) -> None:
+        await self.broker.close()
 
 manager = ConnectManager()
+metrics.gauge('chat_send_queue_depth', manager.queue_depth)
+metrics.gauge('chat_connections', manager.connection_count)
+
 
+async def get_group(db: AsyncSession, group_id: int) ->Optional[ChatGroup]:
+    return await db.get(ChatGroup, group_id)
 
-def is_member(db: Session, group_id: int, user_id: int) -> bool:
-    return db.query(GroupPeople).filter(GroupPeople.group_id == group_id, GroupPeople.user_id == user_id).first() is not None
+async def group_member_ids(db: AsyncSession, group_id: int) -> List[int]:
+    rows = await db.scalars(select(GroupPeople.user_id).where(GroupPeople.group_id == group_id))
+    return list(rows)
 
+def latest_message_id(group_id: int):
+    """The group's newest message id, as the read cursor of someone joining now.
 
-def get_group(db: Session, group_id: int) ->Optional[ChatGroup]:
-    return db.query(ChatGroup).filter(ChatGroup.id == group_id).first()
+    Without it a new member's cursor is NULL and the whole history counts as unread.
+    """
+    return select(func.max(ChatMessage.id)).where(ChatMessage.group_id == group_id).scalar_subquery()
 
-def group_member_ids(db: Session, group_id: int) -> List[int]:
-    rows = db.query(GroupPeople.user_id).filter(GroupPeople.group_id == group_id).all()
-    return [r[0] for r in rows]
+def unread_count():
+    """Correlated count of a member's unread messages, capped at CHAT_UNREAD_CAP.
+
+    Reads at most CHAT_UNREAD_CAP index entries of ix_message_group_id_id per
+    group; clients show the cap as "N+".
+    """
+    newer = select(ChatMessage.id).where(
+        ChatMessage.group_id == GroupPeople.group_id,
+        ChatMessage.id > func.coalesce(GroupPeople.last_read_message_id, 0),
+        ChatMessage.sender_id != GroupPeople.user_id,
+    ).correlate(GroupPeople).limit(CHAT_UNREAD_CAP).subquery()
+    return select(func.count()).select_from(newer).correlate(GroupPeople).scalar_subquery().label('unread')
 
 def group_to_dict(g: ChatGroup) -> dict:
     return {
         'id': g.id,
         'name': g.name,
         'owner_id': g.owner_id,
-        'create_date': g.created_date.isoformat() if g.created_date else None
+        'create_date': g.created_date
 
     }
 
@@ -94,248 +259,317 @@ def msg_to_dict(m: ChatMessage) -> dict:
         'group_id': m.group_id,
         'sender_id': m.sender_id,
         'text': m.text,
-        'created_date': m.created_date.isoformat() if m.created_date else None,
+        'created_date': m.created_date,
 
     }
 
+
+async def reply(websocket: WebSocket, payload: dict) -> None:
+    frame = websocket.state.codec.encode(payload)
+    outbox: Optional[Outbox] = getattr(websocket.state, 'outbox', None)
+    if outbox is None:
+        # not connected yet (auth errors): nothing else writes to the socket
+        await send_frame(websocket, frame)
+        return
+    manager.enqueue(outbox, frame)
+
+
+class ChatError(Exception):
+    def __init__(self, detail: str) -> None:
+        super().__init__(detail)
+        self.detail = detail
+
+
+ActionHandler = Callable[[WebSocket, AsyncSession, AuthUser, Dict[str, Any]], Awaitable[None]]
+ws_actions: Dict[str, ActionHandler] = {}
+
+
+def ws_action(name: str) -> Callable[[ActionHandler], ActionHandler]:
+    """Register a handler for ``{"action": name}`` frames.
+
+    Each call gets its own short-lived session; raise ``ChatError`` to send
+    the client an error event for the action.
+    """
+    def register(handler: ActionHandler) -> ActionHandler:
+        ws_actions[name] = handler
+        return handler
+    return register
+
+
+def _group_id(data: Dict[str, Any]) -> int:
+    group_id = data.get('group_id')
+    if not group_id:
+        raise ChatError('group_id required')
+    return int(group_id)
+
+
+@ws_action('create_group')
+async def create_group(websocket: WebSocket, db: AsyncSession, user: AuthUser, data: Dict[str, Any]) -> None:
+    name = (data.get('name') or "").strip()
+    if not name:
+        raise ChatError('name is required')
+
+    existing = await db.scalar(select(ChatGroup.id).where(ChatGroup.name == name))
+    if existing:
+        raise ChatError('Group already exists')
+
+    # a new group has no history, so the owner's NULL read cursor is already caught up
+    g = ChatGroup(name=name, owner_id=user.id, members=[GroupPeople(user_id=user.id)])
+    db.add(g)
+    await db.commit()
+    manager.set_members(g.id, [user.id])
+
+    await reply(websocket, {'event': 'group_created', 'group': group_to_dict(g)})
+
+
+@ws_action('list_groups')
+async def list_groups(websocket: WebSocket, db: AsyncSession, user: AuthUser, data: Dict[str, Any]) -> None:
+    rows = (await db.execute(
+        select(ChatGroup, GroupPeople.last_read_message_id, unread_count()).
+        join(GroupPeople, GroupPeople.group_id == ChatGroup.id).
+        where(GroupPeople.user_id == user.id).
+        order_by(ChatGroup.id.desc())
+    )).all()
+    items = [{**group_to_dict(g), 'last_read_message_id': last_read, 'unread': unread}
+             for g, last_read, unread in rows]
+    await reply(websocket, {'event': 'groups', 'items': items})
+
+
+@ws_action('mark_read')
+async def mark_read(websocket: WebSocket, db: AsyncSession, user: AuthUser, data: Dict[str, Any]) -> None:
+    group_id = _group_id(data)
+    message_id = data.get('message_id')
+
+    latest = select(func.max(ChatMessage.id)).where(ChatMessage.group_id == group_id).scalar_subquery()
+    # LEAST skips NULLs: in a group without messages nothing can be read yet
+    target = func.least(int(message_id), func.coalesce(latest, 0)) if message_id else latest
+    # the cursor only moves forward; no row back means not a member
+    cursor = await db.scalar(
+        update(GroupPeople).
+        where(GroupPeople.group_id == group_id, GroupPeople.user_id == user.id).
+        values(last_read_message_id=func.greatest(func.coalesce(GroupPeople.last_read_message_id, 0), target)).
+        returning(GroupPeople.last_read_message_id)
+    )
+    if cursor is None:
+        raise ChatError('not a member')
+    await db.commit()
+
+    # every device of this user drops the badge
+    await manager.broadcast_to_users([user.id], {'event': 'read', 'group_id': group_id, 'last_read_message_id': cursor})
+
+
+@ws_action('rename_group')
+async def rename_group(websocket: WebSocket, db: AsyncSession, user: AuthUser, data: Dict[str, Any]) -> None:
+    group_id = data.get('group_id')
+    new_name = (data.get('name') or "").strip()
+    if not group_id or not new_name:
+        raise ChatError('group_id and name required')
+
+    g = await get_group(db, int(group_id))
+    if not g:
+        raise ChatError('group not found')
+    if g.owner_id != user.id:
+        raise ChatError('only owner can rename')
+    g.name = new_name
+    await db.commit()
+
+    members = await manager.members(db, g.id)
+    await manager.broadcast_to_users(members, {'event': 'group_renamed', 'group': group_to_dict(g)})
+
+
+@ws_action('add_members')
+async def add_members(websocket: WebSocket, db: AsyncSession, user: AuthUser, data: Dict[str, Any]) -> None:
+    group_id = data.get('group_id')
+    user_ids = data.get('user_ids') or []
+    if not group_id or not isinstance(user_ids, list) or not user_ids:
+        raise ChatError('group_id and user_ids required')
+
+    g = await get_group(db, int(group_id))
+    if not g:
+        raise ChatError('group not found')
+    if g.owner_id != user.id:
+        raise ChatError('only owner can add members')
+
+    ids = sorted({uid for uid in user_ids if isinstance(uid, int) and not isinstance(uid, bool)})
+    # existing users that are not members yet, inserted in one statement;
+    # ON CONFLICT covers a concurrent add of the same user
+    # joining members start caught up, like the backfill in 8b1e4d2c6a07
+    candidates = select(literal(g.id), UserProfile.id, literal(datetime.utcnow(), DateTime),
+                        latest_message_id(g.id)).where(
+        UserProfile.id == any_(bindparam('ids', ids, type_=ARRAY(Integer))),
+        ~exists().where(GroupPeople.group_id == g.id, GroupPeople.user_id == UserProfile.id))
+    stmt = insert(GroupPeople).from_select(
+        ['group_id', 'user_id', 'joined_date', 'last_read_message_id'], candidates,
+    ).on_conflict_do_nothing(index_elements=['group_id', 'user_id']).returning(GroupPeople.user_id)
+    added = sorted((await db.scalars(stmt)).all()) if ids else []
+    if not added:
+        await reply(websocket, {'event': 'members added', 'group_id': g.id, 'added_user_ids': []})
+        return
+
+    await db.commit()
+    await manager.invalidate_group(g.id)
+
+    members = await manager.members(db, g.id)
+    await manager.broadcast_to_users(members, {'event': 'members added', 'group_id': g.id, 'added_user_ids': added})
+
+
+@ws_action('send_message')
+async def send_message(websocket: WebSocket, db: AsyncSession, user: AuthUser, data: Dict[str, Any]) -> None:
+    group_id = data.get('group_id')
+    text = (data.get('text') or "").strip()
+    if not group_id or not text:
+        raise ChatError('group_id and text required')
+
+    group_id = int(group_id)
+    if not await manager.is_member(db, group_id, user.id):
+        raise ChatError('You are not a member of this group')
+
+    try:
+        m = await message_writer.write(group_id, user.id, text)
+    except IntegrityError:
+        raise ChatError('group not found')
+
+    message = msg_to_dict(m)
+    recent_messages.add(message)
+    members = await manager.members(db, group_id)
+    await manager.broadcast_to_users(members, {'event': 'message', 'message': message})
+
+
+@ws_action('fetch_messages')
+async def fetch_messages(websocket: WebSocket, db: AsyncSession, user: AuthUser, data: Dict[str, Any]) -> None:
+    group_id = _group_id(data)
+    limit = min(int(data.get('limit') or 50), 200)
+    before_id = int(data['before_id']) if data.get('before_id') else None
+
+    if not await manager.is_member(db, group_id, user.id):
+        raise ChatError('not a member')
+
+    items = recent_messages.page(group_id, limit, before_id)
+    if items is None:
+        q = select(ChatMessage).where(ChatMessage.group_id == group_id)
+        if before_id:
+            q = q.where(ChatMessage.id < before_id)
+        else:
+            # read a whole ring's worth so the next latest-page fetches stay in memory
+            recent_messages.begin_load(group_id)
+        size = limit if before_id else max(limit, recent_messages.per_group)
+        msgs = (await db.scalars(q.order_by(ChatMessage.id.desc()).limit(size))).all()
+        items = [msg_to_dict(x) for x in reversed(msgs)]
+        if not before_id:
+            recent_messages.load(group_id, items, complete=len(msgs) < size)
+        items = items[-limit:]
+
+    await reply(websocket, {'event': 'messages', 'group_id': group_id, 'items': items})
+
+
+@ws_action('leave_group')
+async def leave_group(websocket: WebSocket, db: AsyncSession, user: AuthUser, data: Dict[str, Any]) -> None:
+    group_id = _group_id(data)
+    if not await manager.is_member(db, group_id, user.id):
+        raise ChatError('You are not a member')
+    g = await get_group(db, group_id)
+    if not g:
+        raise ChatError('group not found')
+
+    if g.owner_id == user.id:
+        new_owner = await db.scalar(
+            select(GroupPeople.user_id).where(GroupPeople.group_id == g.id, GroupPeople.user_id != user.id).
+            order_by(GroupPeople.id).limit(1))
+        if new_owner is None:
+            await db.delete(g)
+            await db.commit()
+            await manager.invalidate_group(g.id)
+            recent_messages.drop(g.id)
+            await reply(websocket, {'event': 'group_deleted', 'group_id': g.id})
+            return
+        g.owner_id = new_owner
+        await db.commit()
+        await manager.broadcast_to_users(
+            await manager.members(db, g.id),
+            {'event': 'owner_changed', 'group_id': g.id, 'new_owner': new_owner}
+        )
+
+    await db.execute(delete(GroupPeople).where(GroupPeople.group_id == group_id, GroupPeople.user_id == user.id))
+    await db.commit()
+    await manager.invalidate_group(group_id)
+
+    await reply(websocket, {'event': 'left_group', 'group_id': group_id})
+
+
+@ws_action('delete_group')
+async def delete_group(websocket: WebSocket, db: AsyncSession, user: AuthUser, data: Dict[str, Any]) -> None:
+    group_id = _group_id(data)
+    g = await get_group(db, group_id)
+    if not g:
+        raise ChatError('group not found')
+    if g.owner_id != user.id:
+        raise ChatError('only owner can delete')
+
+    await db.execute(delete(GroupPeople).where(GroupPeople.group_id == group_id))
+    await db.delete(g)
+    await db.commit()
+    await manager.invalidate_group(group_id)
+    recent_messages.drop(group_id)
+
+    await reply(websocket, {'event': 'group_deleted', 'group_id': group_id})
+
+
+async def dispatch(websocket: WebSocket, user: AuthUser, data: Dict[str, Any]) -> None:
+    action = data.get('action') if isinstance(data, dict) else None
+    # checked first: an unhashable action (a list, say) would break the lookup
+    handler = ws_actions.get(action) if isinstance(action, str) else None
+    if handler is None:
+        await reply(websocket, {'event': 'error', 'detail': f'Unknown action: {action}'})
+        return
+
+    with query_stats.track(f'ws {action}'):
+        # a fresh session per action: idle sockets hold no session or
+        # connection, and nothing read here outlives the action
+        async with AsyncSessionLocal() as db:
+            try:
+                await handler(websocket, db, user, data)
+            except ChatError as exc:
+                await reply(websocket, {'event': 'error', 'action': action, 'detail': exc.detail})
+            except (TypeError, ValueError):
+                await reply(websocket, {'event': 'error', 'action': action, 'detail': 'invalid payload'})
+
+
 @chat_router.websocket("/ws/chat")
-async def chat_ws(websocket: WebSocket, token: Optional[str] = Query(default=None)):
-    db = SessionLocal()
-    user: Optional[UserProfile] = None
+async def chat_ws(websocket: WebSocket, token: Optional[str] = Query(default=None),
+                  format: Optional[str] = Query(default=None)):
+    user: Optional[AuthUser] = None
+    # JSON unless the client offers the "msgpack" subprotocol or passes ?format=msgpack
+    codec, subprotocol = negotiate(websocket, format)
+    websocket.state.codec = codec
 
     try:
+        await websocket.accept(subprotocol=subprotocol)
         tok = _extract_token(websocket, token)
         if not tok:
-            await websocket.accept()
-            await websocket.send_json({'event': 'error', 'detail': 'Missing token'})
+            await reply(websocket, {'event': 'error', 'detail': 'Missing token'})
             await websocket.close(code=1008)
             return
         try:
-            user = get_user_from_token(db, tok)
+            async with AsyncSessionLocal() as db:
+                user = await user_from_token(db, tok)
         except ValueError:
-            await websocket.accept()
-            await websocket.send_json({'event': 'error', 'detail': 'Invalid token'})
+            await reply(websocket, {'event': 'error', 'detail': 'Invalid token'})
             await websocket.close(code=1008)
             return
 
-
-        await manager.connect(user.id, websocket)
-        await websocket.send_json({'event': 'connected', 'user_id': user.id, 'username': user.username})
+        await manager.connect(user.id, websocket, codec)
+        await reply(websocket, {'event': 'connected', 'user_id': user.id, 'username': user.username})
 
         while True:
-            data: Dict[str, Any] = await websocket.receive_json()
-            action = data.get('action')
-
-            if action == 'create_group':
-               name = (data.get('name')or "").strip()
-               if not name:
-                   await websocket.send_json({'event': 'error', 'action': action, 'detail': 'name is required'})
-                   continue
-
-               existing = db.query(ChatGroup).filter(ChatGroup.name == name).first()
-               if existing:
-                   await websocket.send_json({"event": "error", "detail": "Group already exists"})
-                   continue
-
-               g = ChatGroup(name=name, owner_id=user.id)
-               db.add(g)
-               db.commit()
-               db.refresh(g)
-
-               db.add(GroupPeople(group_id=g.id, user_id=user.id))
-               db.commit()
-
-               await websocket.send_json({'event': 'group_created', 'group': group_to_dict(g)})
-               continue
-
-            if action == 'list_groups':
-                groups = (
-                    db.query(ChatGroup).join(GroupPeople, GroupPeople.group_id == ChatGroup.id).
-                    filter(GroupPeople.user_id == user.id).
-                    order_by(ChatGroup.id.desc()).all()
-                )
-                await websocket.send_json({'event': 'groups', 'items': [group_to_dict(g) for g in groups]})
-                continue
-
-            if action == 'rename_group':
-                group_id = data.get('group_id')
-                new_name = (data.get('name') or "").strip()
-
-                if  not group_id or not new_name:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'group_id and name required'})
-                    continue
-
-                g = get_group(db, int(group_id))
-                if not g:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'group not found'})
-                    continue
-                if g.owner_id != user.id:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'only owner can rename'})
-                    continue
-                g.name = new_name
-                db.commit()
-                db.refresh(g)
-
-                members = group_member_ids(db, g.id)
-                await manager.broadcast_to_users(members, {'event': 'group_renamed', 'group': group_to_dict(g)})
-                continue
-
-            if action == 'add_members':
-                group_id = data.get('group_id')
-                user_ids = data.get('user_ids') or []
-
-                if not group_id or not isinstance(user_ids, list) or not user_ids:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'group_id and user_ids required'})
-                    continue
-
-                g = get_group(db, int(group_id))
-                if not g:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'group not found'})
-                    continue
-
-                if g.owner_id != user.id:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'only owner can add members'})
-                    continue
-
-                added: List[int] = []
-                for uid in user_ids:
-                    if not isinstance(uid, int):
-                        continue
-                    exists_user = db.query(UserProfile.id).filter(UserProfile.id == uid).first()
-                    if not exists_user:
-                        continue
-                    already = db.query(GroupPeople).filter(GroupPeople.group_id == g.id,GroupPeople.user_id == uid).first()
-                    if already:
-                        continue
-                    db.add(GroupPeople(group_id=g.id, user_id=uid))
-                    added.append(uid)
-
-                    db.commit()
-
-                    members = group_member_ids(db, g.id)
-                    await manager.broadcast_to_users(members, {'event': 'members added', 'group_id': g.id, 'added_user_ids': added})
-                    continue
-
-
-            if action == 'send_message':
-                group_id = data.get('group_id')
-                text = (data.get('text')or "").strip()
-                if not group_id or not text:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'group_id and text required'})
-                    continue
-
-                if not is_member(db, int(group_id), user.id):
-                    await websocket.send_json(
-                        {'event': 'error', 'action': action, 'detail': 'You are not a member of this group'})
-                    continue
-
-                m = ChatMessage(group_id=group_id, sender_id=user.id, text=text)
-                db.add(m)
-                db.commit()
-                db.refresh(m)
-
-                members = group_member_ids(db, group_id)
-                await manager.broadcast_to_users(members, {'event': 'message', 'message': msg_to_dict(m)})
-                continue
-
-            if action == 'fetch_messages':
-                group_id = data.get('group_id')
-                limit = int(data.get('limit') or 50)
-                before_id = data.get('before_id')
-
-                if not group_id:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'group_id required'})
-                    continue
-
-                group_id = int(group_id)
-                if not is_member(db, group_id, user.id):
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'not a member'})
-                    continue
-
-                q = db.query(ChatMessage).filter(ChatMessage.group_id == group_id)
-                if before_id:
-                    q =  q.filter(ChatMessage.id < int(before_id))
-                msgs = q.order_by(ChatMessage.id.desc()).limit(min(limit, 200)).all()
-                msgs = list(reversed(msgs))
-
-                await websocket.send_json({'event': 'messages', 'group_id': group_id, 'items': [msg_to_dict(x) for x in msgs]})
-                continue
-
-            await websocket.send_json({'event': 'error', 'detail': f'Unknown action: {action}'})
-
-
-            if action == 'leave_group':
-                group_id = data.get('group_id')
-                if not group_id:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'group_id required'})
-                    continue
-
-                group_id = int(group_id)
-                if not is_member(db, group_id, user.id):
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'You are not a member'})
-                    continue
-                g = get_group(db, int(group_id))
-                if not g:
-                    await websocket.send_json({'event': 'error', 'detail': 'group not found'})
-                    continue
-
-                if not is_member(db, g.id, user.id):
-                    await websocket.send_json({'event': 'error', 'detail': 'not a member'})
-                    continue
-
-                if g.owner_id == user.id:
-                    other_members = db.query(GroupPeople).filter(GroupPeople.group_id == g.id,
-                                                                 GroupPeople.user_id != user.id).all()
-                    if other_members:
-                        new_owner = other_members[0].user_id
-                        g.owner_id = new_owner
-                        db.commit()
-                        await manager.broadcast_to_users(
-                            group_member_ids(db, g.id),
-                            {'event': 'owner_changed', 'group_id': g.id, 'new_owner': new_owner}
-                        )
-                    else:
-                        db.delete(g)
-                        db.commit()
-                        await websocket.send_json({'event': 'group_deleted', 'group_id': g.id})
-                        continue
-
-                gp = db.query(GroupPeople).filter(GroupPeople.group_id == group_id,
-                                                  GroupPeople.user_id == user.id).first()
-                if gp:
-                    db.delete(gp)
-                    db.commit()
-
-                await websocket.send_json({'event': 'left_group', 'group_id': group_id})
-                continue
-
-            if action == 'delete_group':
-                group_id = data.get('group_id')
-                if not group_id:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'group_id required'})
-                    continue
-
-                group_id = int(group_id)
-                g = get_group(db, group_id)
-                if not g:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'group not found'})
-                    continue
-
-                if g.owner_id != user.id:
-                    await websocket.send_json({'event': 'error', 'action': action, 'detail': 'only owner can delete'})
-                    continue
-
-                db.query(GroupPeople).filter(GroupPeople.group_id == group_id).delete()
-                db.delete(g)
-                db.commit()
-
-                await websocket.send_json({'event': 'group_deleted', 'group_id': group_id})
+            try:
+                data: Dict[str, Any] = await receive(websocket, codec)
+            except ValueError:
+                await reply(websocket, {'event': 'error', 'detail': 'invalid payload'})
                 continue
+            await dispatch(websocket, user, data)
 
     except WebSocketDisconnect:
         pass
     finally:
         if user is not None:
             manager.disconnect(user.id, websocket)
-        db.close()
-
@@ -1,39 +1,37 @@
 from fastapi import APIRouter, HTTPException, Depends
 from duolingo_app.database.models import ChatGroup
-from duolingo_app.database.schema import ChatGroupOutSchema, ChatGroupInputSchema
-from duolingo_app.database.db import SessionLocal
-from sqlalchemy.orm import Session
-from typing import List
+from duolingo_app.database.schema import ChatGroupOutSchema, ChatGroupInputSchema, Page
+from duolingo_app.database.db import get_db
+from duolingo_app.recent_messages import recent_messages
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from .pagination import PageParams, paginate
+from .chat_message import manager
 
 
 group_router = APIRouter(prefix="/group", tags=["ChatGroup"])
 
 
-async def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @group_router.post("/", response_model= ChatGroupOutSchema)
-async def create_group(group: ChatGroupInputSchema, db: Session = Depends(get_db)):
+async def create_group(group: ChatGroupInputSchema, db: AsyncSession = Depends(get_db)):
     group_db = ChatGroup(**group.dict())
     db.add(group_db)
-    db.commit()
-    db.refresh(group_db)
+    await db.commit()
     return group_db
 
 
-@group_router.get("/", response_model=List[ChatGroupOutSchema])
-async def list_groups(db: Session = Depends(get_db)):
-    return db.query(ChatGroup).all()
+@group_router.get("/", response_model=Page[ChatGroupOutSchema])
+async def list_groups(
+    owner_id: Optional[int] = None,
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(get_db),
+):
+    return await paginate(db, ChatGroup, ChatGroupOutSchema, page, owner_id=owner_id)
 
 
 @group_router.get("/{group_id}", response_model= ChatGroupOutSchema)
-async def detail_group(group_id: int, db: Session = Depends(get_db)):
-    group_db = db.query(ChatGroup).filter(ChatGroup.id == group_id).first()
+async def detail_group(group_id: int, db: AsyncSession = Depends(get_db)):
+    group_db = await db.get(ChatGroup, group_id)
     if not group_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
     return group_db
@@ -43,26 +41,27 @@ async def detail_group(group_id: int, db: Session = Depends(get_db)):
 async def update_group(
     group_id: int,
     group: ChatGroupInputSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    group_db = db.query(ChatGroup).filter(ChatGroup.id == group_id).first()
+    group_db = await db.get(ChatGroup, group_id)
     if not group_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
 
     for group_key, group_value in group.dict().items():
         setattr(group_db, group_key, group_value)
 
-    db.commit()
-    db.refresh(group_db)
+    await db.commit()
     return {"message": "Группа озгорулду"}
 
 
 @group_router.delete("/{group_id}", response_model=dict)
-async def delete_group(group_id: int, db: Session = Depends(get_db)):
-    group_db = db.query(ChatGroup).filter(ChatGroup.id == group_id).first()
+async def delete_group(group_id: int, db: AsyncSession = Depends(get_db)):
+    group_db = await db.get(ChatGroup, group_id)
     if not group_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
 
-    db.delete(group_db)
-    db.commit()
+    await db.delete(group_db)
+    await db.commit()
+    await manager.invalidate_group(group_id)
+    recent_messages.drop(group_id)
     return {"message": "Группа очурулду"}
@@ -1,35 +1,35 @@
-from fastapi import APIRouter, HTTPException, Depends
-from duolingo_app.database.models import Exercise
-from duolingo_app.database.schema import ExerciseOutSchema, ExerciseInputSchema
-from duolingo_app.database.db import SessionLocal
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Body
+from duolingo_app.database.models import Exercise, Lesson
+from duolingo_app.database.schema import ExerciseOutSchema, ExerciseInputSchema, Page, BulkResult
+from duolingo_app.database.db import get_db
+from duolingo_app.database.projection import fetch_by_id
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, List, Dict, Any
+from .pagination import PageParams, paginate
+from .bulk import bulk_write
 
 
 exercise_router = APIRouter(prefix='/exercise', tags=['Exercise'])
 
-async def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @exercise_router.post('/', response_model=ExerciseOutSchema)
-async def create_ex(ex: ExerciseInputSchema, db: Session = Depends(get_db)):
+async def create_ex(ex: ExerciseInputSchema, db: AsyncSession = Depends(get_db)):
     ex_db = Exercise(**ex.dict())
     db.add(ex_db)
-    db.commit()
-    db.refresh(ex_db)
+    await db.commit()
 
     return ex_db
-@exercise_router.get('/', response_model=List[ExerciseOutSchema])
-async def list_ex(db:Session = Depends(get_db)):
-    return db.query(Exercise).all()
+
+@exercise_router.post('/bulk', response_model=BulkResult[ExerciseOutSchema])
+async def bulk_create_ex(rows: List[Dict[str, Any]] = Body(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_write(db, Exercise, ExerciseInputSchema, rows, parents={'lesson_id': Lesson})
+
+@exercise_router.get('/', response_model=Page[ExerciseOutSchema])
+async def list_ex(lesson_id: Optional[int] = None, page: PageParams = Depends(), db: AsyncSession = Depends(get_db)):
+    return await paginate(db, Exercise, ExerciseOutSchema, page, lesson_id=lesson_id)
 
 @exercise_router.get('/{ex_id}/', response_model=ExerciseOutSchema)
-async def detail_ex(ex_id: int, db: Session = Depends(get_db)):
-    ex_db = db.query(Exercise).filter(Exercise.id == ex_id).first()
+async def detail_ex(ex_id: int, db: AsyncSession = Depends(get_db)):
+    ex_db = await fetch_by_id(db, Exercise, ExerciseOutSchema, ex_id)
     if not ex_db:
         raise HTTPException(detail='No such Exercise', status_code=400)
 
@@ -37,27 +37,25 @@ async def detail_ex(ex_id: int, db: Session = Depends(get_db)):
 
 
 @exercise_router.put('/{ex_id}/', response_model=dict)
-async def update_ex(ex_id: int, ex: ExerciseInputSchema, db: Session = Depends(get_db)):
-    ex_db = db.query(Exercise).filter(Exercise.id == ex_id).first()
+async def update_ex(ex_id: int, ex: ExerciseInputSchema, db: AsyncSession = Depends(get_db)):
+    ex_db = await db.get(Exercise, ex_id)
     if not ex_db:
         raise HTTPException(detail='No such Exercise', status_code=400)
 
     for key, value in ex.dict().items():
         setattr(ex_db, key, value)
 
-    db.commit()
-    db.refresh(ex_db)
+    await db.commit()
 
     return {'message': 'Exercise update'}
 
 @exercise_router.delete('/{ex_id}/', response_model=dict)
-async def delete_ex(ex_id: int, db: Session = Depends(get_db)):
-    ex_db = db.query(Exercise).filter(Exercise.id == ex_id).first()
+async def delete_ex(ex_id: int, db: AsyncSession = Depends(get_db)):
+    ex_db = await db.get(Exercise, ex_id)
     if not ex_db:
         raise HTTPException(detail='No such Exercise', status_code=400)
 
-    db.delete(ex_db)
-    db.commit()
-
-
+    await db.delete(ex_db)
+    await db.commit()
 
+    return {'message': 'Exercise delete'}
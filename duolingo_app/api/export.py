@@ -0,0 +1,54 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Literal, Optional
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+from duolingo_app.config import EXPORT_BATCH_SIZE
+from duolingo_app.database.db import AsyncSessionLocal
+
+ExportFormat = Literal['ndjson', 'csv']
+
+MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def date_range(stmt: Select, column, date_from: Optional[datetime], date_to: Optional[datetime]) -> Select:
+    if date_from is not None:
+        stmt = stmt.where(column >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(column < date_to)
+    return stmt
+
+
+def _default(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+async def _iter_rows(stmt: Select, fmt: ExportFormat) -> AsyncIterator[str]:
+    # the export owns its session: it has to outlive the endpoint function
+    # and keep the server-side cursor open while the response is sent
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        keys = list(result.keys())
+        if fmt == 'csv':
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(keys)
+            async for rows in result.partitions():
+                writer.writerows(rows)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            yield buf.getvalue()
+        else:
+            async for rows in result.partitions():
+                yield ''.join(json.dumps(dict(zip(keys, row)), default=_default) + '\n' for row in rows)
+
+
+def export_response(stmt: Select, fmt: ExportFormat, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        _iter_rows(stmt, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'},
+    )
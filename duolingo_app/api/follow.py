@@ -1,46 +1,39 @@
 from fastapi import APIRouter, HTTPException, Depends
 from duolingo_app.database.models import Follow
-from duolingo_app.database.schema import FollowInputSchema, FollowOutSchema
-from duolingo_app.database.db import SessionLocal
-from sqlalchemy.orm import Session
-from typing import List
+from duolingo_app.database.schema import FollowInputSchema, FollowOutSchema, Page
+from duolingo_app.database.db import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from .pagination import PageParams, paginate
 
 
 follow_router = APIRouter(prefix="/follow", tags=["Follow"])
 
 
-async def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @follow_router.post("/", response_model=FollowOutSchema)
 async def create_follow(
     follow: FollowInputSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     follow_db = Follow(**follow.dict())
     db.add(follow_db)
-    db.commit()
-    db.refresh(follow_db)
+    await db.commit()
     return follow_db
 
 
-@follow_router.get("/", response_model=List[FollowOutSchema])
-async def list_follows(db: Session = Depends(get_db)):
-    return db.query(Follow).all()
+@follow_router.get("/", response_model=Page[FollowOutSchema])
+async def list_follows(
+    follower_id: Optional[int] = None,
+    followed_id: Optional[int] = None,
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(get_db),
+):
+    return await paginate(db, Follow, FollowOutSchema, page, follower_id=follower_id, followed_id=followed_id)
 
 
 @follow_router.get("/{follow_id}", response_model=FollowOutSchema)
-async def detail_follow(follow_id: int, db: Session = Depends(get_db)):
-    follow_db = (
-        db.query(Follow)
-        .filter(Follow.id == follow_id)
-        .first()
-    )
+async def detail_follow(follow_id: int, db: AsyncSession = Depends(get_db)):
+    follow_db = await db.get(Follow, follow_id)
     if not follow_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
     return follow_db
@@ -50,37 +43,28 @@ async def detail_follow(follow_id: int, db: Session = Depends(get_db)):
 async def update_follow(
     follow_id: int,
     follow: FollowInputSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    follow_db = (
-        db.query(Follow)
-        .filter(Follow.id == follow_id)
-        .first()
-    )
+    follow_db = await db.get(Follow, follow_id)
     if not follow_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
 
     for follow_key, follow_value in follow.dict().items():
         setattr(follow_db, follow_key, follow_value)
 
-    db.commit()
-    db.refresh(follow_db)
+    await db.commit()
     return {"message": "Follow озгорулду"}
 
 
 @follow_router.delete("/{follow_id}", response_model=dict)
 async def delete_follow(
     follow_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    follow_db = (
-        db.query(Follow)
-        .filter(Follow.id == follow_id)
-        .first()
-    )
+    follow_db = await db.get(Follow, follow_id)
     if not follow_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
 
-    db.delete(follow_db)
-    db.commit()
+    await db.delete(follow_db)
+    await db.commit()
     return {"message": "Follow очурулду"}
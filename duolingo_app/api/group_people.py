@@ -1,46 +1,43 @@
 from fastapi import APIRouter, HTTPException, Depends
 from duolingo_app.database.models import GroupPeople
-from duolingo_app.database.schema import GroupPeopleOutSchema, GroupPeopleInputSchema
-from duolingo_app.database.db import SessionLocal
-from sqlalchemy.orm import Session
-from typing import List
+from duolingo_app.database.schema import GroupPeopleOutSchema, GroupPeopleInputSchema, Page
+from duolingo_app.database.db import get_db
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from .pagination import PageParams, paginate
+from .chat_message import latest_message_id, manager
 
 
 people_router = APIRouter(prefix="/people", tags=["people"])
 
 
-async def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @people_router.post("/", response_model=GroupPeopleOutSchema)
 async def create_people(
     people: GroupPeopleInputSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    people_db = GroupPeople(**people.dict())
-    db.add(people_db)
-    db.commit()
-    db.refresh(people_db)
+    # joins caught up with the group's history, read back in the same statement
+    people_db = await db.scalar(insert(GroupPeople).values(
+        **people.dict(), last_read_message_id=latest_message_id(people.group_id)).returning(GroupPeople))
+    await db.commit()
+    await manager.invalidate_group(people_db.group_id)
     return people_db
 
 
-@people_router.get("/", response_model=List[GroupPeopleOutSchema])
-async def list_people(db: Session = Depends(get_db)):
-    return db.query(GroupPeople).all()
+@people_router.get("/", response_model=Page[GroupPeopleOutSchema])
+async def list_people(
+    group_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(get_db),
+):
+    return await paginate(db, GroupPeople, GroupPeopleOutSchema, page, group_id=group_id, user_id=user_id)
 
 
 @people_router.get("/{people_id}", response_model=GroupPeopleOutSchema)
-async def detail_people(people_id: int, db: Session = Depends(get_db)):
-    people_db = (
-        db.query(GroupPeople)
-        .filter(GroupPeople.id == people_id)
-        .first()
-    )
+async def detail_people(people_id: int, db: AsyncSession = Depends(get_db)):
+    people_db = await db.get(GroupPeople, people_id)
     if not people_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
     return people_db
@@ -50,37 +47,32 @@ async def detail_people(people_id: int, db: Session = Depends(get_db)):
 async def update_people(
     people_id: int,
     people: GroupPeopleInputSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    people_db = (
-        db.query(GroupPeople)
-        .filter(GroupPeople.id == people_id)
-        .first()
-    )
+    people_db = await db.get(GroupPeople, people_id)
     if not people_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
 
+    old_group_id = people_db.group_id
     for people_key, people_value in people.dict().items():
         setattr(people_db, people_key, people_value)
 
-    db.commit()
-    db.refresh(people_db)
+    await db.commit()
+    await manager.invalidate_group(old_group_id)
+    await manager.invalidate_group(people_db.group_id)
     return {"message": "Адамдын маалыматы озгорулду"}
 
 
 @people_router.delete("/{people_id}", response_model=dict)
 async def delete_people(
     people_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    people_db = (
-        db.query(GroupPeople)
-        .filter(GroupPeople.id == people_id)
-        .first()
-    )
+    people_db = await db.get(GroupPeople, people_id)
     if not people_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
 
-    db.delete(people_db)
-    db.commit()
+    await db.delete(people_db)
+    await db.commit()
+    await manager.invalidate_group(people_db.group_id)
     return {"message": "Адамдын маалыматы очурулду"}
@@ -1,63 +1,67 @@
 from fastapi import APIRouter, HTTPException, Depends
 from duolingo_app.database.models import XPHistory
-from duolingo_app.database.schema import XPHistoryOutSchema, XPHistoryInputSchema
-from duolingo_app.database.db import SessionLocal
-from sqlalchemy.orm import Session
-from typing import List
+from duolingo_app.database.schema import XPHistoryOutSchema, XPHistoryInputSchema, Page
+from duolingo_app.database.db import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from datetime import datetime
+from .pagination import PageParams, paginate
+from .export import ExportFormat, date_range, export_response
 
 history_router = APIRouter(prefix='/history', tags=['XpHistory'])
 
-async def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @history_router.post('/', response_model=XPHistoryOutSchema)
-async def create_history(history: XPHistoryInputSchema, db: Session = Depends(get_db)):
+async def create_history(history: XPHistoryInputSchema, db: AsyncSession = Depends(get_db)):
     history_db = XPHistory(**history.dict())
     db.add(history_db)
-    db.commit()
-    db.refresh(history_db)
+    await db.commit()
 
     return history_db
 
-@history_router.get('/', response_model=List[XPHistoryOutSchema])
-async def list_history(db: Session = Depends(get_db)):
-    return db.query(XPHistory).all()
+@history_router.get('/', response_model=Page[XPHistoryOutSchema])
+async def list_history(user_id: Optional[int] = None, page: PageParams = Depends(), db: AsyncSession = Depends(get_db)):
+    return await paginate(db, XPHistory, XPHistoryOutSchema, page, user_id=user_id)
+
+@history_router.get('/export')
+async def export_history(user_id: Optional[int] = None, date_from: Optional[datetime] = None,
+                         date_to: Optional[datetime] = None, format: ExportFormat = 'ndjson'):
+    stmt = select(XPHistory.__table__).order_by(XPHistory.id)
+    if user_id is not None:
+        stmt = stmt.where(XPHistory.user_id == user_id)
+    stmt = date_range(stmt, XPHistory.created_at, date_from, date_to)
+    return export_response(stmt, format, 'history')
 
 
 @history_router.get('/{history_id}/', response_model=XPHistoryOutSchema)
-async def detail_history(history_id: int, db: Session = Depends(get_db)):
-    history_db = db.query(XPHistory).filter(XPHistory.id == history_id).first()
+async def detail_history(history_id: int, db: AsyncSession = Depends(get_db)):
+    history_db = await db.get(XPHistory, history_id)
     if not history_db:
         raise HTTPException(detail='No such XPHistory', status_code=400)
 
     return history_db
 
 @history_router.put('/{history_id}/', response_model=dict)
-async def update_history(history_id: int , history: XPHistoryInputSchema, db: Session = Depends(get_db)):
-    history_db = db.query(XPHistory).filter(XPHistory.id == history_id).first()
+async def update_history(history_id: int , history: XPHistoryInputSchema, db: AsyncSession = Depends(get_db)):
+    history_db = await db.get(XPHistory, history_id)
     if not history_db:
         raise HTTPException(detail='No such XPHistory', status_code=400)
 
     for key, value in history.dict().items():
         setattr(history_db, key, value)
 
-    db.commit()
-    db.refresh(history_db)
+    await db.commit()
 
     return {'message': 'XPHistory update'}
 
 
 @history_router.delete('/{history_id}/', response_model=dict)
-async def delete_history(history_id: int, db: Session = Depends(get_db)):
-    history_db = db.query(XPHistory).filter(XPHistory.id == history_id)
+async def delete_history(history_id: int, db: AsyncSession = Depends(get_db)):
+    history_db = await db.get(XPHistory, history_id)
     if not history_db:
         raise HTTPException(detail='No such XPHistory', status_code=400)
 
-    db.delete(history_db)
-    db.commit()
+    await db.delete(history_db)
+    await db.commit()
 
-    return {'message': 'XPHistory delete'}
\ No newline at end of file
+    return {'message': 'XPHistory delete'}
@@ -1,62 +1,62 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
+from duolingo_app import catalog
 from duolingo_app.database.models import Language
-from duolingo_app.database.schema import LanguageOutSchema, LanguageInputSchema
-from duolingo_app.database.db import SessionLocal
-from sqlalchemy.orm import Session
-from typing import List
+from duolingo_app.database.schema import LanguageOutSchema, LanguageInputSchema, LanguageCatalogSchema, Page
+from duolingo_app.database.db import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from .pagination import PageParams, paginate
 
 language_router = APIRouter(prefix='/language', tags=['Language'])
 
-async def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @language_router.post('/', response_model=LanguageOutSchema)
-async def create_language(language: LanguageInputSchema, db: Session = Depends(get_db)):
+async def create_language(language: LanguageInputSchema, db: AsyncSession = Depends(get_db)):
     language_db = Language(**language.dict())
     db.add(language_db)
-    db.commit()
-    db.refresh(language_db)
+    await db.commit()
 
     return language_db
 
-@language_router.get('/', response_model=List[LanguageOutSchema])
-async def list_language(db: Session = Depends(get_db)):
-    return db.query(Language).all()
+@language_router.get('/', response_model=Page[LanguageOutSchema])
+async def list_language(page: PageParams = Depends(), db: AsyncSession = Depends(get_db)):
+    return await paginate(db, Language, LanguageOutSchema, page)
 
 
 @language_router.get('/{language_id}/', response_model=LanguageOutSchema)
-async def detail_language(language_id: int, db: Session = Depends(get_db)):
-    language_db = db.query(Language).filter(Language.id == language_id).first()
+async def detail_language(language_id: int, db: AsyncSession = Depends(get_db)):
+    language_db = await db.get(Language, language_id)
     if not language_db:
         raise HTTPException(detail='No such Language',status_code=400)
 
     return language_db
 
+@language_router.get('/{code}/catalog', response_model=LanguageCatalogSchema)
+async def language_catalog(code: str, request: Request, db: AsyncSession = Depends(get_db)):
+    entry = await catalog.language_catalog(db, code)
+    if entry is None:
+        raise HTTPException(detail='No such Language', status_code=400)
+
+    return catalog.respond(request, entry)
+
 @language_router.put('/{language_id}/', response_model=dict)
-async def update_language(language_id: int, language: LanguageInputSchema, db: Session = Depends(get_db)):
-    language_db = db.query(Language).filter(Language.id == language_id).first()
+async def update_language(language_id: int, language: LanguageInputSchema, db: AsyncSession = Depends(get_db)):
+    language_db = await db.get(Language, language_id)
     if not language_db:
         raise HTTPException(detail='No such Language', status_code=400)
 
     for key, value in language.dict().items():
         setattr(language_db, key, value)
 
-    db.commit()
-    db.refresh(language_db)
+    await db.commit()
 
     return {'message': 'Language update'}
 
 @language_router.delete('/{language_id}/', response_model=dict)
-async def delete_language(language_id: int, db: Session = Depends(get_db)):
-    language_db = db.query(Language).filter(Language.id == language_id).first()
+async def delete_language(language_id: int, db: AsyncSession = Depends(get_db)):
+    language_db = await db.get(Language, language_id)
     if not language_db:
         raise HTTPException(detail='No such Language', status_code=400)
 
-    db.delete(language_db)
-    db.commit()
+    await db.delete(language_db)
+    await db.commit()
 
-    return {'message': 'Language delete'}
\ No newline at end of file
+    return {'message': 'Language delete'}
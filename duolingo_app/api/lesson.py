@@ -1,62 +1,59 @@
-from fastapi import APIRouter, HTTPException, Depends
-from duolingo_app.database.models import Lesson
-from duolingo_app.database.schema import LessonOutSchema, LessonInputSchema
-from duolingo_app.database.db import SessionLocal
-from sqlalchemy.orm import  Session
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Body
+from duolingo_app.database.models import Lesson, Course
+from duolingo_app.database.schema import LessonOutSchema, LessonInputSchema, Page, BulkResult
+from duolingo_app.database.db import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, List, Dict, Any
+from .pagination import PageParams, paginate
+from .bulk import bulk_write
 
 lesson_router = APIRouter(prefix='/lesson', tags=['Lesson'])
 
-async def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @lesson_router.post('/', response_model=LessonOutSchema)
-async def create_lesson(lesson: LessonInputSchema, db: Session = Depends(get_db)):
+async def create_lesson(lesson: LessonInputSchema, db: AsyncSession = Depends(get_db)):
     lesson_db = Lesson(**lesson.dict())
     db.add(lesson_db)
-    db.commit()
-    db.refresh(lesson_db)
+    await db.commit()
 
     return lesson_db
 
-@lesson_router.get('/', response_model=List[LessonOutSchema])
-async def list_lesson(db: Session = Depends(get_db)):
-    return db.query(Lesson).all()
+@lesson_router.post('/bulk', response_model=BulkResult[LessonOutSchema])
+async def bulk_upsert_lessons(rows: List[Dict[str, Any]] = Body(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_write(db, Lesson, LessonInputSchema, rows, parents={'course_id': Course},
+                            conflict=('course_id', 'order'), update=('title', 'is_locked'))
+
+@lesson_router.get('/', response_model=Page[LessonOutSchema])
+async def list_lesson(course_id: Optional[int] = None, page: PageParams = Depends(), db: AsyncSession = Depends(get_db)):
+    return await paginate(db, Lesson, LessonOutSchema, page, course_id=course_id)
 
 @lesson_router.get('/{lesson_id}/', response_model=LessonOutSchema)
-async def detail_lesson(lesson_id: int, db: Session = Depends(get_db)):
-    lesson_db = db.query(Lesson).filter(Lesson.id == lesson_id).first()
+async def detail_lesson(lesson_id: int, db: AsyncSession = Depends(get_db)):
+    lesson_db = await db.get(Lesson, lesson_id)
     if not lesson_db:
         raise HTTPException(detail='No such Lesson', status_code=400)
 
     return lesson_db
 
 @lesson_router.put('/{lesson_id}/', response_model=dict)
-async def update_lesson(lesson_id: int, lesson: LessonInputSchema, db: Session = Depends(get_db)):
-    lesson_db = db.query(Lesson).filter(Lesson.id == lesson_id).first()
+async def update_lesson(lesson_id: int, lesson: LessonInputSchema, db: AsyncSession = Depends(get_db)):
+    lesson_db = await db.get(Lesson, lesson_id)
     if not lesson_db:
         raise HTTPException(detail='No such Lesson', status_code=400)
 
     for key, value in lesson.dict().items():
-        setattr(lesson_id, key, value)
+        setattr(lesson_db, key, value)
 
-    db.commit()
-    db.refresh(lesson_db)
+    await db.commit()
 
     return {'message': 'Lesson update'}
 
 @lesson_router.delete('/{lesson_id}/', response_model=dict)
-async def delete_lesson(lesson_id: int, db: Session = Depends(get_db)):
-    lesson_db = db.query(Lesson).filter(Lesson.id == lesson_id).first()
+async def delete_lesson(lesson_id: int, db: AsyncSession = Depends(get_db)):
+    lesson_db = await db.get(Lesson, lesson_id)
     if not lesson_db:
         raise HTTPException(detail='No such Lesson', status_code=400)
 
-    db.delete(lesson_db)
-    db.commit()
+    await db.delete(lesson_db)
+    await db.commit()
 
-    return {'message': 'Lesson delete'}
\ No newline at end of file
+    return {'message': 'Lesson delete'}
@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from duolingo_app.database.models import ChatMessage
+from sqlalchemy import select
+from typing import Optional
+from datetime import datetime
+from .export import ExportFormat, date_range, export_response
+
+
+message_router = APIRouter(prefix='/message', tags=['ChatMessage'])
+
+
+@message_router.get('/export')
+async def export_messages(group_id: Optional[int] = None, sender_id: Optional[int] = None,
+                          date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                          format: ExportFormat = 'ndjson'):
+    stmt = select(ChatMessage.__table__).order_by(ChatMessage.id)
+    if group_id is not None:
+        stmt = stmt.where(ChatMessage.group_id == group_id)
+    if sender_id is not None:
+        stmt = stmt.where(ChatMessage.sender_id == sender_id)
+    stmt = date_range(stmt, ChatMessage.created_date, date_from, date_to)
+    return export_response(stmt, format, 'message')
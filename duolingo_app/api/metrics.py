@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from duolingo_app import metrics
+from duolingo_app.database.db import async_engine
+from duolingo_app.database.pool import pool_stats
+
+
+metrics_router = APIRouter(prefix='/metrics', tags=['Metrics'])
+
+
+@metrics_router.get('/', response_model=dict)
+async def get_metrics():
+    return metrics.snapshot()
+
+
+@metrics_router.get('/db-pool/', response_model=dict)
+async def get_pool_stats():
+    return pool_stats(async_engine.pool)
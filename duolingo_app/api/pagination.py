@@ -0,0 +1,51 @@
+import base64
+from typing import Optional, Type
+from pydantic import BaseModel
+from fastapi import HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from duolingo_app.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from duolingo_app.database.projection import select_for, fetch_all
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(detail='Invalid cursor', status_code=400)
+
+
+class PageParams:
+    def __init__(
+        self,
+        after_id: Optional[int] = Query(default=None, ge=0),
+        cursor: Optional[str] = Query(default=None),
+        limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1),
+    ):
+        self.after_id = decode_cursor(cursor) if cursor else after_id
+        self.limit = min(limit, MAX_PAGE_SIZE)
+
+
+async def paginate(db: AsyncSession, model: Type, schema: Type[BaseModel], page: PageParams, **filters) -> dict:
+    """Keyset page over ``model.id``; ``None`` filters are ignored.
+
+    Only the columns ``schema`` needs are selected and rows come back as
+    plain dicts, skipping ORM hydration.
+    """
+    stmt = select_for(model, schema)
+    for column, value in filters.items():
+        if value is not None:
+            stmt = stmt.where(getattr(model, column) == value)
+    if page.after_id is not None:
+        stmt = stmt.where(model.id > page.after_id)
+
+    rows = await fetch_all(db, stmt.order_by(model.id).limit(page.limit + 1))
+    next_cursor = None
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        next_cursor = encode_cursor(rows[-1]['id'])
+    return {'items': rows, 'next_cursor': next_cursor}
@@ -1,11 +1,12 @@
 from fastapi import APIRouter, HTTPException, Depends
 from duolingo_app.database.models import PaidSubScription
 from duolingo_app.database.schema import (
-            PaidSubScriptionOutSchema,PaidSubScriptionInputSchema
+            PaidSubScriptionOutSchema,PaidSubScriptionInputSchema, Page
 )
-from duolingo_app.database.db import SessionLocal
-from sqlalchemy.orm import Session
-from typing import List
+from duolingo_app.database.db import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from .pagination import PageParams, paginate
 
 
 paid_subscription_router = APIRouter(
@@ -14,35 +15,28 @@ paid_subscription_router = APIRouter(
 )
 
 
-async def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @paid_subscription_router.post(
     "/", response_model=PaidSubScriptionOutSchema
 )
 async def create_paid_subscription(
     subscription: PaidSubScriptionInputSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     subscription_db = PaidSubScription(**subscription.dict())
     db.add(subscription_db)
-    db.commit()
-    db.refresh(subscription_db)
+    await db.commit()
     return subscription_db
 
 
 @paid_subscription_router.get(
-    "/", response_model=List[PaidSubScriptionOutSchema]
+    "/", response_model=Page[PaidSubScriptionOutSchema]
 )
 async def list_paid_subscriptions(
-    db: Session = Depends(get_db),
+    user_id: Optional[int] = None,
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(get_db),
 ):
-    return db.query(PaidSubScription).all()
+    return await paginate(db, PaidSubScription, PaidSubScriptionOutSchema, page, user_id=user_id)
 
 
 @paid_subscription_router.get(
@@ -51,13 +45,9 @@ async def list_paid_subscriptions(
 )
 async def detail_paid_subscription(
     subscription_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    subscription_db = (
-        db.query(PaidSubScription)
-        .filter(PaidSubScription.id == subscription_id)
-        .first()
-    )
+    subscription_db = await db.get(PaidSubScription, subscription_id)
     if not subscription_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
     return subscription_db
@@ -69,21 +59,16 @@ async def detail_paid_subscription(
 async def update_paid_subscription(
     subscription_id: int,
     subscription: PaidSubScriptionInputSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    subscription_db = (
-        db.query(PaidSubScription)
-        .filter(PaidSubScription.id == subscription_id)
-        .first()
-    )
+    subscription_db = await db.get(PaidSubScription, subscription_id)
     if not subscription_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
 
     for sub_key, sub_value in subscription.dict().items():
         setattr(subscription_db, sub_key, sub_value)
 
-    db.commit()
-    db.refresh(subscription_db)
+    await db.commit()
     return {"message": "Жазылуу жаңыртылды"}
 
 
@@ -92,16 +77,12 @@ async def update_paid_subscription(
 )
 async def delete_paid_subscription(
     subscription_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    subscription_db = (
-        db.query(PaidSubScription)
-        .filter(PaidSubScription.id == subscription_id)
-        .first()
-    )
+    subscription_db = await db.get(PaidSubScription, subscription_id)
     if not subscription_db:
         raise HTTPException(detail="Мындай маалымат жок", status_code=400)
 
-    db.delete(subscription_db)
-    db.commit()
+    await db.delete(subscription_db)
+    await db.commit()
     return {"message": "Жазылуу өчүрүлдү"}
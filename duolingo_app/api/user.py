@@ -1,28 +1,86 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Body
+from pydantic import ValidationError
+from duolingo_app.config import USER_BULK_MAX_ROWS
 from duolingo_app.database.models import UserProfile
-from duolingo_app.database.schema import UserProfileInputSchema, UserProfileOutSchema
-from duolingo_app.database.db import SessionLocal
-from sqlalchemy.orm import Session
-from typing import List
-from .auth import get_password_hash
+from duolingo_app.database.schema import UserProfileInputSchema, UserProfileOutSchema, Page, BulkResult
+from duolingo_app.database.db import get_db
+from duolingo_app.database.projection import fetch_by_id
+from sqlalchemy import insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, List, Optional
+from .pagination import PageParams, paginate
+from .auth import taken_field
+from duolingo_app.passwords import hash_password, hash_passwords
 
 
 user_router = APIRouter(prefix='/user', tags=['user'])
 
-async def get_db():
-    db = SessionLocal()
+@user_router.get('/', response_model=Page[UserProfileOutSchema])
+async def list_user(is_active: Optional[bool] = None, page: PageParams = Depends(), db: AsyncSession = Depends(get_db)):
+    return await paginate(db, UserProfile, UserProfileOutSchema, page, is_active=is_active)
+
+@user_router.post('/bulk', response_model=BulkResult[UserProfileOutSchema])
+async def bulk_create_users(rows: List[Dict[str, Any]] = Body(...), db: AsyncSession = Depends(get_db)):
+    """Provision a class of users at once (school onboarding).
+
+    Rows that fail validation or reuse a username/email (taken, or earlier in
+    the same request) are reported per row; the rest have their passwords
+    hashed in parallel on the password pool and go into one batched INSERT.
+    """
+    if len(rows) > USER_BULK_MAX_ROWS:
+        raise HTTPException(detail=f'At most {USER_BULK_MAX_ROWS} users per request', status_code=413)
+
+    errors: List[dict] = []
+    valid: List[tuple] = []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, UserProfileInputSchema.model_validate(row).model_dump()))
+        except ValidationError as exc:
+            errors.append({'index': index, 'detail': exc.errors(include_url=False, include_context=False)})
+
+    usernames = {row['username'] for _, row in valid}
+    emails = {row['email'] for _, row in valid}
+    taken = (await db.execute(select(UserProfile.username, UserProfile.email).where(
+        or_(UserProfile.username.in_(usernames), UserProfile.email.in_(emails))))).all() if valid else []
+    seen_usernames = {username for username, _ in taken}
+    seen_emails = {email for _, email in taken}
+    kept = []
+    for index, row in valid:
+        if row['username'] in seen_usernames:
+            errors.append({'index': index, 'detail': 'such username already exists'})
+        elif row['email'] in seen_emails:
+            errors.append({'index': index, 'detail': 'such email address already exists'})
+        else:
+            seen_usernames.add(row['username'])
+            seen_emails.add(row['email'])
+            kept.append((index, row))
+    valid = kept
+
+    errors.sort(key=lambda e: e['index'])
+    if not valid:
+        return {'items': [], 'errors': errors}
+
+    hashes = await hash_passwords([row['password'] for _, row in valid])
+    for (_, row), password in zip(valid, hashes):
+        row['password'] = password
     try:
-        yield db
-    finally:
-        db.close()
+        result = await db.scalars(
+            insert(UserProfile).returning(UserProfile, sort_by_parameter_order=True),
+            [row for _, row in valid],
+        )
+        items = result.all()
+        await db.commit()
+    except IntegrityError as exc:
+        await db.rollback()
+        raise HTTPException(detail=f'such {taken_field(exc)} already exists', status_code=400)
+
+    return {'items': items, 'errors': errors}
 
-@user_router.get('/', response_model=List[UserProfileOutSchema])
-async def list_user(db: Session = Depends(get_db)):
-    return db.query(UserProfile).all()
 
 @user_router.get('/{user_id}', response_model=UserProfileOutSchema)
-async def detail_user(user_id: int, db: Session = Depends(get_db)):
-    user_db = db.query(UserProfile).filter(UserProfile.id==user_id).first()
+async def detail_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    user_db = await fetch_by_id(db, UserProfile, UserProfileOutSchema, user_id)
 
     if not user_db:
         raise HTTPException(detail='no such user', status_code=400)
@@ -31,11 +89,11 @@ async def detail_user(user_id: int, db: Session = Depends(get_db)):
 
 
 @user_router.put('/{user_id}', response_model=dict)
-def update_user(
+async def update_user(
     user_id: int,
     user: UserProfileInputSchema,
-    db: Session = Depends(get_db)):
-    user_db = db.query(UserProfile).filter(UserProfile.id == user_id).first()
+    db: AsyncSession = Depends(get_db)):
+    user_db = await db.get(UserProfile, user_id)
 
     if not user_db:
         raise HTTPException(status_code=404, detail='no such profile')
@@ -45,23 +103,22 @@ def update_user(
             setattr(user_db, key, value)
 
     if user.password:
-        user_db.password = get_password_hash(user.password)
+        user_db.password = await hash_password(user.password)
 
-    db.commit()
-    db.refresh(user_db)
+    await db.commit()
 
     return {'message': 'changed profile'}
 
 
 @user_router.delete('/{user_id}', response_model=dict)
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user_db = db.query(UserProfile).filter(UserProfile.id == user_id).first()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    user_db = await db.get(UserProfile, user_id)
 
     if not user_db:
         raise HTTPException(detail='no such profile', status_code=404)
 
-    db.delete(user_db)
-    db.commit()
+    await db.delete(user_db)
+    await db.commit()
 
 
     return {'message': 'deleted profile'}
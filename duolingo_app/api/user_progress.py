@@ -1,62 +1,76 @@
-from fastapi import APIRouter, HTTPException, Depends
-from duolingo_app.database.models import UserProgress
-from duolingo_app.database.schema import UserProgressOutSchema, UserProgressInputSchema
-from duolingo_app.database.db import SessionLocal
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Body
+from duolingo_app.database.models import UserProgress, UserProfile, Lesson
+from duolingo_app.database.schema import UserProgressOutSchema, UserProgressInputSchema, Page, BulkResult
+from duolingo_app.database.db import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, List, Dict, Any
+from datetime import datetime
+from .pagination import PageParams, paginate
+from .bulk import bulk_write
+from .export import ExportFormat, date_range, export_response
 
 
 progress_router = APIRouter(prefix='/user_progress', tags=['User progress'])
 
-async def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @progress_router.post('/', response_model=UserProgressOutSchema)
-async def create_progress(progress: UserProgressInputSchema, db: Session = Depends(get_db)):
+async def create_progress(progress: UserProgressInputSchema, db: AsyncSession = Depends(get_db)):
     progress_db = UserProgress(**progress.dict())
     db.add(progress_db)
-    db.commit()
-    db.refresh(progress_db)
+    await db.commit()
 
     return progress_db
 
-@progress_router.get('/', response_model=List[UserProgressOutSchema])
-async def list_progress(db: Session = Depends(get_db)):
-    db.query(UserProgress).all()
+@progress_router.post('/bulk', response_model=BulkResult[UserProgressOutSchema])
+async def bulk_upsert_progress(rows: List[Dict[str, Any]] = Body(...), db: AsyncSession = Depends(get_db)):
+    return await bulk_write(db, UserProgress, UserProgressInputSchema, rows,
+                            parents={'user_id': UserProfile, 'lesson_id': Lesson},
+                            conflict=('user_id', 'lesson_id'), update=('completed', 'score', 'completed_at'))
+
+@progress_router.get('/', response_model=Page[UserProgressOutSchema])
+async def list_progress(user_id: Optional[int] = None, lesson_id: Optional[int] = None, page: PageParams = Depends(), db: AsyncSession = Depends(get_db)):
+    return await paginate(db, UserProgress, UserProgressOutSchema, page, user_id=user_id, lesson_id=lesson_id)
+
+@progress_router.get('/export')
+async def export_progress(user_id: Optional[int] = None, lesson_id: Optional[int] = None,
+                          date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                          format: ExportFormat = 'ndjson'):
+    stmt = select(UserProgress.__table__).order_by(UserProgress.id)
+    if user_id is not None:
+        stmt = stmt.where(UserProgress.user_id == user_id)
+    if lesson_id is not None:
+        stmt = stmt.where(UserProgress.lesson_id == lesson_id)
+    stmt = date_range(stmt, UserProgress.completed_at, date_from, date_to)
+    return export_response(stmt, format, 'user_progress')
 
 @progress_router.get('/{progress_id}/', response_model=UserProgressOutSchema)
-async def detail_progress(progress_id: int, db: Session = Depends(get_db)):
-    progress_db = db.query(UserProgress).filter(UserProgress.id == progress_id).first()
+async def detail_progress(progress_id: int, db: AsyncSession = Depends(get_db)):
+    progress_db = await db.get(UserProgress, progress_id)
     if not progress_db:
         raise HTTPException(detail='No such UserProgress', status_code=400)
 
     return progress_db
 
 @progress_router.put('/{progress_id}/', response_model=dict)
-async def update_progress(progress_id: int, progress: UserProgressInputSchema, db: Session = Depends(get_db)):
-    progress_db = db.query(UserProgress).filter(UserProgress.id == progress_id).first()
+async def update_progress(progress_id: int, progress: UserProgressInputSchema, db: AsyncSession = Depends(get_db)):
+    progress_db = await db.get(UserProgress, progress_id)
     if not progress_db:
         raise HTTPException(detail='No such UserProgress', status_code=400)
 
     for key, value in progress.dict().items():
         setattr(progress_db, key, value)
 
-    db.commit()
-    db.refresh(progress_db)
+    await db.commit()
 
     return {'message': 'UserProgress update'}
 
 @progress_router.delete('/{progress_id}/', response_model=dict)
-async def delete_progress(progress_id: int, db: Session = Depends(get_db)):
-    progress_db = db.query(UserProgress).filter(UserProgress.id == progress_id).first()
+async def delete_progress(progress_id: int, db: AsyncSession = Depends(get_db)):
+    progress_db = await db.get(UserProgress, progress_id)
     if not progress_db:
         raise HTTPException(detail='No such UserProgress',status_code=400)
 
-    db.delete(progress_db)
-    db.commit()
+    await db.delete(progress_db)
+    await db.commit()
 
     return {'message': 'UserProgress delete'}
@@ -0,0 +1,272 @@
+import asyncio
+import base64
+import json
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+from sqlalchemy.engine import make_url
+from duolingo_app import metrics
+from duolingo_app.config import ASYNC_DB_URL, CHAT_BROKER, CHAT_BROKER_URL, CHAT_CHANNEL
+
+logger = logging.getLogger('duolingo_app.broker')
+
+published_total = metrics.counter('chat_broker_published_total')
+received_total = metrics.counter('chat_broker_received_total')
+publish_errors = metrics.counter('chat_broker_publish_errors_total')
+
+Handler = Callable[[dict], None]
+
+
+def _encode_default(obj):
+    # payload timestamps stay datetimes so every worker encodes them per socket codec
+    if isinstance(obj, datetime):
+        return {'$dt': obj.isoformat()}
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+def _decode_hook(obj: dict):
+    if len(obj) == 1 and '$dt' in obj:
+        return datetime.fromisoformat(obj['$dt'])
+    return obj
+
+
+class Broker(ABC):
+    """Fans chat envelopes out to the other workers.
+
+    Every worker delivers to its own sockets itself, so envelopes a worker
+    published are ignored when they come back to it.
+    """
+
+    def __init__(self, channel: str = CHAT_CHANNEL) -> None:
+        self.channel = channel
+        self.node_id = uuid4().hex
+        self._handler: Optional[Handler] = None
+        self._started = False
+        self._connected_once = False
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._reconnecting: Optional[asyncio.Task] = None
+
+    def subscribe(self, handler: Handler) -> None:
+        self._handler = handler
+
+    async def start(self) -> None:
+        if self._started:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if not self._started:
+                await self._connect()
+                self._started = True
+                if self._connected_once and self._handler is not None:
+                    # envelopes may have been missed while disconnected
+                    self._handler({'reset': True})
+                self._connected_once = True
+
+    async def publish(self, envelope: dict) -> None:
+        try:
+            await self.start()
+            data = json.dumps({**envelope, 'origin': self.node_id}, separators=(',', ':'), default=_encode_default)
+            await self._send(data)
+        except Exception:
+            publish_errors.inc()
+            logger.exception('chat broker publish failed')
+            return
+        published_total.inc()
+
+    async def close(self) -> None:
+        self._started = False
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+            self._reconnecting = None
+
+    def _connection_lost(self) -> None:
+        """Reconnect in the background; start() then sends the handler a reset."""
+        self._started = False
+        if self._reconnecting is None or self._reconnecting.done():
+            self._reconnecting = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = 0.5
+        while not self._started:
+            try:
+                await self.start()
+            except Exception:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def _receive(self, data: str) -> None:
+        envelope = json.loads(data, object_hook=_decode_hook)
+        if envelope.pop('origin', None) == self.node_id:
+            return
+        received_total.inc()
+        if self._handler is not None:
+            self._handler(envelope)
+
+    @abstractmethod
+    async def _connect(self) -> None:
+        ...
+
+    @abstractmethod
+    async def _send(self, data: str) -> None:
+        ...
+
+
+class InProcessBroker(Broker):
+    """Brokers sharing a hub see each other's envelopes; a lone one is a no-op."""
+
+    _default_hub: List['InProcessBroker'] = []
+
+    def __init__(self, channel: str = CHAT_CHANNEL, hub: Optional[List['InProcessBroker']] = None) -> None:
+        super().__init__(channel)
+        self._hub = self._default_hub if hub is None else hub
+
+    async def _connect(self) -> None:
+        # still there when reconnecting without a close()
+        if self not in self._hub:
+            self._hub.append(self)
+
+    def _peers(self) -> List['InProcessBroker']:
+        return [peer for peer in self._hub if peer is not self and peer.channel == self.channel]
+
+    async def publish(self, envelope: dict) -> None:
+        if self._peers():
+            await super().publish(envelope)
+            return
+        # alone (a single worker): nobody to encode the envelope for
+        await self.start()
+        published_total.inc()
+
+    async def _send(self, data: str) -> None:
+        for peer in self._peers():
+            peer._receive(data)
+
+    async def close(self) -> None:
+        if self in self._hub:
+            self._hub.remove(self)
+        await super().close()
+
+
+class PostgresBroker(Broker):
+    """LISTEN/NOTIFY on a dedicated asyncpg connection per worker."""
+
+    # NOTIFY payloads must stay under 8000 bytes; larger envelopes go out in
+    # base64 parts inside one transaction, so they arrive together and in order
+    CHUNK_BYTES = 5000
+
+    def __init__(self, dsn: str, channel: str = CHAT_CHANNEL) -> None:
+        super().__init__(channel)
+        self._dsn = dsn
+        self._conn = None
+        self._closing = False
+        self._send_lock = asyncio.Lock()
+        self._parts: Dict[str, List[str]] = {}
+
+    async def _connect(self) -> None:
+        import asyncpg
+
+        self._conn = await asyncpg.connect(self._dsn)
+        await self._conn.add_listener(self.channel, self._on_notify)
+        self._conn.add_termination_listener(self._on_terminated)
+
+    def _on_terminated(self, conn) -> None:
+        if self._closing:
+            return
+        logger.warning('chat broker lost its postgres connection, reconnecting')
+        self._connection_lost()
+
+    def _on_notify(self, conn, pid: int, channel: str, payload: str) -> None:
+        if not payload.startswith('#'):
+            self._receive(payload)
+            return
+        message_id, seq, total, part = payload[1:].split(':', 3)
+        parts = self._parts.setdefault(message_id, [])
+        parts.append(part)
+        if len(parts) == int(total):
+            del self._parts[message_id]
+            self._receive(b''.join(base64.b64decode(p) for p in parts).decode())
+
+    async def _send(self, data: str) -> None:
+        raw = data.encode()
+        async with self._send_lock:
+            if len(raw) <= self.CHUNK_BYTES:
+                await self._conn.execute('SELECT pg_notify($1, $2)', self.channel, data)
+                return
+            message_id = uuid4().hex
+            chunks = [raw[i:i + self.CHUNK_BYTES] for i in range(0, len(raw), self.CHUNK_BYTES)]
+            async with self._conn.transaction():
+                for seq, chunk in enumerate(chunks):
+                    part = f'#{message_id}:{seq}:{len(chunks)}:{base64.b64encode(chunk).decode()}'
+                    await self._conn.execute('SELECT pg_notify($1, $2)', self.channel, part)
+
+    async def close(self) -> None:
+        self._closing = True
+        await super().close()
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
+        self._closing = False
+
+
+class RedisBroker(Broker):
+    """PUBLISH/SUBSCRIBE on any Redis-protocol server (needs the optional redis package)."""
+
+    def __init__(self, url: str, channel: str = CHAT_CHANNEL) -> None:
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError('CHAT_BROKER=redis needs the redis package: pip install redis')
+        super().__init__(channel)
+        self._client = redis.from_url(url, decode_responses=True)
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def _connect(self) -> None:
+        if self._pubsub is not None:
+            # left over from a lost connection
+            try:
+                await self._pubsub.aclose()
+            except Exception:
+                pass
+        self._pubsub = self._client.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._reader = asyncio.get_running_loop().create_task(self._read())
+
+    async def _read(self) -> None:
+        try:
+            async for message in self._pubsub.listen():
+                if message['type'] == 'message':
+                    try:
+                        self._receive(message['data'])
+                    except Exception:
+                        logger.exception('chat broker could not handle an envelope')
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning('chat broker lost its redis connection, reconnecting', exc_info=True)
+        # also when the subscription ended by itself: either way envelopes are being missed
+        self._connection_lost()
+
+    async def _send(self, data: str) -> None:
+        await self._client.publish(self.channel, data)
+
+    async def close(self) -> None:
+        await super().close()
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self._client.aclose()
+
+
+def create_broker(kind: str = CHAT_BROKER) -> Broker:
+    if kind == 'memory':
+        return InProcessBroker()
+    if kind == 'postgres':
+        dsn = make_url(ASYNC_DB_URL).set(drivername='postgresql').render_as_string(hide_password=False)
+        return PostgresBroker(dsn)
+    if kind == 'redis':
+        return RedisBroker(CHAT_BROKER_URL)
+    raise ValueError(f'Unknown CHAT_BROKER: {kind}')
@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+from duolingo_app import metrics
+
+
+class TTLCache:
+    """In-process LRU mapping whose entries also expire.
+
+    Per worker and not shared: callers that cache rows must invalidate on
+    writes and pick a ``ttl`` they can live with for writes made elsewhere.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._hits = metrics.counter(f'{name}_cache_hits_total')
+        self._misses = metrics.counter(f'{name}_cache_misses_total')
+        metrics.gauge(f'{name}_cache_size', self.__len__)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self._misses.inc()
+            return default
+        self._data.move_to_end(key)
+        self._hits.inc()
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else float('inf')
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
@@ -0,0 +1,122 @@
+import hashlib
+from operator import attrgetter
+from typing import Awaitable, Callable, Hashable, NamedTuple, Optional
+from fastapi import Request, Response
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
+from duolingo_app.cache import TTLCache
+from duolingo_app.config import CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL
+from duolingo_app.database.models import Course, Exercise, Language, Lesson, SubCourse
+from duolingo_app.database.schema import CourseOutlineSchema, CourseTreeSchema, LanguageCatalogSchema
+
+CATALOG_MODELS = (Language, Course, SubCourse, Lesson, Exercise)
+_TABLES = frozenset(model.__table__ for model in CATALOG_MODELS)
+
+# bumped after every commit that wrote a catalog row; trees built under an
+# older version are never served again
+version = 0
+# (kind, key, version) -> Entry; other workers' writes show up within the ttl
+_cache = TTLCache('catalog', CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+
+
+class Entry(NamedTuple):
+    etag: str
+    body: bytes
+
+
+def _sort(course: CourseTreeSchema) -> None:
+    course.subcourses.sort(key=attrgetter('id'))
+    course.lessons.sort(key=attrgetter('order'))
+    for lesson in course.lessons:
+        lesson.exercises.sort(key=attrgetter('id'))
+
+
+async def _cached(key: Hashable, build: Callable[[], Awaitable[Optional[str]]]) -> Optional[Entry]:
+    seen = version
+    entry = _cache.get((*key, seen))
+    if entry is None:
+        body = await build()
+        if body is None:
+            return None
+        body = body.encode()
+        # a content hash, so every worker hands out the same tag for the same tree
+        entry = Entry(f'"{hashlib.sha1(body).hexdigest()[:20]}"', body)
+        # a write committed meanwhile may or may not be in what was read
+        if version == seen:
+            _cache.set((*key, seen), entry)
+    return entry
+
+
+async def course_outline(db: AsyncSession, course_id: int) -> Optional[Entry]:
+    """One course with its language, subcourses and lessons with their exercises: 4 queries."""
+    async def build() -> Optional[str]:
+        course = await db.scalar(select(Course).where(Course.id == course_id).options(
+            joinedload(Course.language),
+            selectinload(Course.subcourses),
+            selectinload(Course.lessons).selectinload(Lesson.exercises),
+        ))
+        if course is None:
+            return None
+        outline = CourseOutlineSchema.model_validate(course)
+        _sort(outline)
+        return outline.model_dump_json()
+
+    return await _cached(('course', course_id), build)
+
+
+async def language_catalog(db: AsyncSession, code: str) -> Optional[Entry]:
+    """A language with every course tree in it: 5 queries however many courses there are."""
+    async def build() -> Optional[str]:
+        courses = selectinload(Language.courses)
+        language = await db.scalar(select(Language).where(Language.code == code).options(
+            courses.selectinload(Course.subcourses),
+            courses.selectinload(Course.lessons).selectinload(Lesson.exercises),
+        ))
+        if language is None:
+            return None
+        catalog = LanguageCatalogSchema.model_validate(language)
+        catalog.courses.sort(key=attrgetter('order'))
+        for course in catalog.courses:
+            _sort(course)
+        return catalog.model_dump_json()
+
+    return await _cached(('language', code), build)
+
+
+def respond(request: Request, entry: Entry) -> Response:
+    headers = {'ETag': entry.etag}
+    if request.headers.get('if-none-match') == entry.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type='application/json', headers=headers)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _watch_bulk_writes(orm_execute_state):
+    # insert()/update()/delete() statements bypass the unit of work
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        if getattr(orm_execute_state.statement, 'table', None) in _TABLES:
+            orm_execute_state.session.info['catalog_changed'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _watch_flush(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, CATALOG_MODELS):
+            session.info['catalog_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_version(session):
+    global version
+    if session.info.pop('catalog_changed', False):
+        version += 1
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _forget_changes(session, transaction):
+    # only when the outermost transaction ends: a SAVEPOINT rolling back
+    # leaves what the rest of the transaction wrote to be committed
+    if transaction.parent is None:
+        session.info.pop('catalog_changed', None)
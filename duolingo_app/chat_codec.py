@@ -0,0 +1,96 @@
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple, Union
+import msgpack
+from fastapi import WebSocket, WebSocketDisconnect
+
+Frame = Union[str, bytes]
+
+
+class Codec(ABC):
+    name = ''
+    binary = False
+
+    @abstractmethod
+    def encode(self, payload: Any) -> Frame:
+        ...
+
+    @abstractmethod
+    def decode(self, frame: Frame) -> Any:
+        ...
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+class JsonCodec(Codec):
+    """The default: text frames, ISO timestamps."""
+
+    name = 'json'
+
+    def encode(self, payload: Any) -> Frame:
+        return json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=_json_default)
+
+    def decode(self, frame: Frame) -> Any:
+        return json.loads(frame)
+
+
+def _msgpack_default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        # stored as naive UTC; milliseconds since the epoch pack into 5-9 bytes
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=timezone.utc)
+        return int(obj.timestamp() * 1000)
+    raise TypeError(f'{type(obj).__name__} is not MessagePack serializable')
+
+
+class MsgpackCodec(Codec):
+    """Binary frames, same keys as JSON, timestamps as epoch milliseconds."""
+
+    name = 'msgpack'
+    binary = True
+
+    def __init__(self) -> None:
+        self._packer = msgpack.Packer(default=_msgpack_default, use_bin_type=True)
+
+    def encode(self, payload: Any) -> Frame:
+        return self._packer.pack(payload)
+
+    def decode(self, frame: Frame) -> Any:
+        return msgpack.unpackb(frame, raw=False)
+
+
+codecs: Dict[str, Codec] = {codec.name: codec for codec in (JsonCodec(), MsgpackCodec())}
+
+
+def negotiate(websocket: WebSocket, fmt: Optional[str]) -> Tuple[Codec, Optional[str]]:
+    """Pick a codec from the offered subprotocols, then ``?format=``; JSON otherwise.
+
+    Returns the codec and the subprotocol to accept with (if one was offered).
+    """
+    for subprotocol in websocket.scope.get('subprotocols') or ():
+        if subprotocol in codecs:
+            return codecs[subprotocol], subprotocol
+    return codecs.get(fmt or 'json', codecs['json']), None
+
+
+async def send_frame(websocket: WebSocket, frame: Frame) -> None:
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
+
+
+async def receive(websocket: WebSocket, codec: Codec) -> Any:
+    """The next decoded frame; ValueError if it is not one the codec reads."""
+    message = await websocket.receive()
+    if message['type'] == 'websocket.disconnect':
+        raise WebSocketDisconnect(message.get('code', 1000), message.get('reason'))
+    frame = message.get('bytes') if codec.binary else message.get('text')
+    if frame is None:
+        raise ValueError(f'{codec.name} sockets take {"binary" if codec.binary else "text"} frames')
+    return codec.decode(frame)
@@ -3,7 +3,7 @@ from datetime import datetime, date
 from enum import Enum as PyEnum
 from typing import Optional, List, Dict, Any
 from sqlalchemy import (Integer, String, Enum, Boolean, DateTime, Date,
-                        ForeignKey, Text, JSON, UniqueConstraint)
+                        ForeignKey, Text, JSON, UniqueConstraint, Index, text)
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .db import Base
 
@@ -36,6 +36,8 @@ class OptionChoices(str, PyEnum):
 
 class UserProfile(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        Index("ix_users_active_id", "id", postgresql_where=text("is_active")),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     username: Mapped[str] = mapped_column(String(60), unique=True, index=True)
@@ -109,8 +111,13 @@ class RefreshToken(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
-    token: Mapped[str] = mapped_column(String, nullable=False)
-    created_date: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    # sha256 hex of the token; the token itself is never stored
+    token_hash: Mapped[str] = mapped_column(String(64), unique=True, index=True, nullable=False)
+    # every token refreshed from the same login shares the family
+    family: Mapped[str] = mapped_column(String(32), nullable=False, index=True)
+    # set once the token was exchanged; presenting it again revokes the family
+    used: Mapped[bool] = mapped_column(Boolean, default=False, server_default=text('false'), nullable=False)
+    created_date: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False, index=True)
 
     user: Mapped["UserProfile"] = relationship("UserProfile", back_populates="tokens")
 
@@ -232,14 +239,16 @@ class Exercise(Base):
 
 class UserProgress(Base):
     __tablename__ = 'user_progress'
-    __table_args__ = (UniqueConstraint("user_id", "lesson_id", name="uq_progress_user_lesson"),)
+    __table_args__ = (
+        UniqueConstraint("user_id", "lesson_id", name="uq_progress_user_lesson"),
+        Index("ix_user_progress_user_id_completed", "user_id", "completed"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     completed: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     score: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     completed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
 
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     user: Mapped["UserProfile"] = relationship("UserProfile", back_populates="progress_user")
 
     lesson_id: Mapped[int] = mapped_column(ForeignKey("lesson.id"), nullable=False, index=True)
@@ -256,13 +265,15 @@ class UserProgress(Base):
 
 class XPHistory(Base):
     __tablename__ = 'history'
+    __table_args__ = (
+        Index("ix_history_user_id_created_at", "user_id", "created_at"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     xp: Mapped[int] = mapped_column(Integer, nullable=False)
     reason: Mapped[str] = mapped_column(String(255), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
 
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     user: Mapped["UserProfile"] = relationship("UserProfile", back_populates="history_user")
 
     def __repr__(self) -> str:
@@ -319,15 +330,18 @@ class ChatGroup(Base):
 class GroupPeople(Base):
     __tablename__ = 'group_people'
     __table_args__ = (
-        UniqueConstraint("group_id", "user_id", name="uq_group_people_group_user"),)
+        UniqueConstraint("group_id", "user_id", name="uq_group_people_group_user"),
+        Index("ix_group_people_user_id_group_id", "user_id", "group_id"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     joined_date: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    # read cursor: messages in the group with a greater id are unread for this member
+    last_read_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     group_id: Mapped[int] = mapped_column(ForeignKey("chat_group.id"), nullable=False, index=True)
     group: Mapped["ChatGroup"] = relationship("ChatGroup", back_populates="members")
 
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     user: Mapped["UserProfile"] = relationship("UserProfile", back_populates="group_memberships")
 
     def __repr__(self) -> str:
@@ -336,13 +350,15 @@ class GroupPeople(Base):
 
 class ChatMessage(Base):
     __tablename__ = 'message'
+    __table_args__ = (
+        Index("ix_message_group_id_id", "group_id", text("id DESC")),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     text: Mapped[str] = mapped_column(Text, nullable=False)
     created_date: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
     is_read: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
 
-    group_id: Mapped[int] = mapped_column(ForeignKey("chat_group.id"), nullable=False, index=True)
+    group_id: Mapped[int] = mapped_column(ForeignKey("chat_group.id"), nullable=False)
     group: Mapped["ChatGroup"] = relationship("ChatGroup", back_populates="messages")
 
     sender_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
@@ -0,0 +1,35 @@
+import time
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool
+from duolingo_app import metrics
+
+
+checkout_seconds = metrics.histogram('db_pool_checkout_seconds')
+checkout_timeouts = metrics.counter('db_pool_checkout_timeouts_total')
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long callers wait for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            # connection errors and cancellations go up uncounted
+            checkout_timeouts.inc()
+            raise
+        finally:
+            checkout_seconds.observe(time.perf_counter() - start)
+
+
+def pool_stats(pool: Pool) -> dict:
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        # overflow() counts down from 0 while checkouts are below pool_size
+        'overflow': max(0, pool.overflow()),
+        'checkout_wait_seconds_total': round(checkout_seconds.sum, 6),
+        'checkout_timeouts': checkout_timeouts.value,
+    }
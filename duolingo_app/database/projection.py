@@ -0,0 +1,23 @@
+from typing import List, Optional, Type
+from pydantic import BaseModel
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def columns_for(model: Type, schema: Type[BaseModel]) -> list:
+    """Mapped columns backing the fields of an ``*OutSchema``."""
+    return [getattr(model, name) for name in schema.model_fields]
+
+
+def select_for(model: Type, schema: Type[BaseModel]) -> Select:
+    return select(*columns_for(model, schema))
+
+
+async def fetch_all(db: AsyncSession, stmt: Select) -> List[dict]:
+    # plain rows: no ORM instances, no identity map
+    return [dict(row) for row in (await db.execute(stmt)).mappings()]
+
+
+async def fetch_by_id(db: AsyncSession, model: Type, schema: Type[BaseModel], obj_id: int) -> Optional[dict]:
+    row = (await db.execute(select_for(model, schema).where(model.id == obj_id))).mappings().first()
+    return dict(row) if row is not None else None
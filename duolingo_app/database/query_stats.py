@@ -0,0 +1,80 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from duolingo_app import metrics
+from duolingo_app.config import DB_QUERY_REPEAT_LIMIT, DB_QUERY_STRICT
+
+logger = logging.getLogger('duolingo_app.sql')
+
+statements_total = metrics.counter('db_statements_total')
+statement_seconds = metrics.histogram('db_statement_seconds')
+
+_PARAM = re.compile(r"\$\d+(::\w+)?|%\(\w+\)s|\?|\b\d+\b")
+_PARAM_LIST = re.compile(r"\?(\s*,\s*\?)+")
+_SPACE = re.compile(r"\s+")
+
+
+class RepeatedQueryError(RuntimeError):
+    pass
+
+
+class QueryStats:
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Counter = Counter()
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.seconds += elapsed
+        shape = statement_shape(statement)
+        self.shapes[shape] += 1
+        if self.shapes[shape] == DB_QUERY_REPEAT_LIMIT + 1:
+            message = f'{self.label}: statement repeated more than {DB_QUERY_REPEAT_LIMIT} times (N+1?): {shape}'
+            if DB_QUERY_STRICT:
+                raise RepeatedQueryError(message)
+            logger.warning(message)
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar('query_stats', default=None)
+
+
+def statement_shape(statement: str) -> str:
+    shape = _PARAM.sub('?', statement)
+    shape = _PARAM_LIST.sub('?', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+@contextmanager
+def track(label: str) -> Iterator[QueryStats]:
+    stats = QueryStats(label)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        logger.debug('%s: %d statements, %.1f ms', label, stats.count, stats.seconds * 1000)
+
+
+def install(engine: Engine) -> None:
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        # on the execution context rather than the connection, so a statement
+        # that fails (no after_cursor_execute) leaves nothing behind
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_start
+        statements_total.inc()
+        statement_seconds.observe(elapsed)
+        stats = _current.get()
+        if stats is not None:
+            stats.record(statement, elapsed)
@@ -1,12 +1,26 @@
 from datetime import datetime, date
-from typing import Optional, Dict, Any, Union
+from typing import Optional, Dict, Any, Union, List, Generic, TypeVar
 from pydantic import BaseModel, EmailStr, ConfigDict, Field
 from .models import RoleChoices, LevelChoices, TypeChoices, OptionChoices
 
+T = TypeVar('T')
+
 
 class ORMBase(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+
+class BulkRowError(BaseModel):
+    index: int
+    detail: Any
+
+class BulkResult(BaseModel, Generic[T]):
+    items: List[T]
+    errors: List[BulkRowError] = []
+
 class UserProfileOutSchema(ORMBase):
     id: int
     username: str
@@ -39,7 +53,8 @@ class UserLoginSchema(BaseModel):
 class RefreshTokenOutSchema(ORMBase):
     id: int
     user_id: int
-    token: str
+    family: str
+    used: bool
     created_date: datetime
 
 
@@ -126,6 +141,19 @@ class ExerciseInputSchema(BaseModel):
     article: OptionChoices = OptionChoices.an
     lesson_id: int
 
+class LessonOutlineSchema(LessonOutSchema):
+    exercises: List[ExerciseOutSchema] = []
+
+class CourseTreeSchema(CourseOutSchema):
+    subcourses: List[SubCourseOutSchema] = []
+    lessons: List[LessonOutlineSchema] = []
+
+class CourseOutlineSchema(CourseTreeSchema):
+    language: LanguageOutSchema
+
+class LanguageCatalogSchema(LanguageOutSchema):
+    courses: List[CourseTreeSchema] = []
+
 class XPHistoryOutSchema(ORMBase):
     id: int
     xp: int
@@ -164,6 +192,7 @@ class GroupPeopleOutSchema(ORMBase):
     joined_date: datetime
     group_id: int
     user_id: int
+    last_read_message_id: Optional[int] = None
 
 class GroupPeopleInputSchema(BaseModel):
     group_id: int
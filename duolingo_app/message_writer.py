@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import logging
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from duolingo_app import metrics
+from duolingo_app.config import CHAT_WRITE_BATCH_SIZE, CHAT_WRITE_DELAY_MS
+from duolingo_app.database.db import AsyncSessionLocal
+from duolingo_app.database.models import ChatMessage
+
+logger = logging.getLogger('duolingo_app.message_writer')
+
+batch_rows = metrics.histogram('chat_write_batch_rows', (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+flush_seconds = metrics.histogram('chat_write_flush_seconds')
+wait_seconds = metrics.histogram('chat_write_wait_seconds')
+write_errors = metrics.counter('chat_write_errors_total')
+
+Pending = Tuple[dict, 'asyncio.Future[ChatMessage]', float]
+
+
+class MessageWriter:
+    """Group commit for chat messages.
+
+    Senders enqueue a row and wait; one background task collects rows for up
+    to ``delay`` seconds (or ``batch_size`` rows) and writes them with a
+    single multi-row INSERT ... RETURNING in one transaction. Rows keep their
+    queue order, so ids follow the order messages were sent in.
+    """
+
+    def __init__(self, batch_size: int = CHAT_WRITE_BATCH_SIZE, delay: float = CHAT_WRITE_DELAY_MS / 1000,
+                 session_factory=AsyncSessionLocal) -> None:
+        self.batch_size = batch_size
+        self.delay = delay
+        self._session_factory = session_factory
+        self._queue: Optional['asyncio.Queue[Pending]'] = None
+        self._task: Optional['asyncio.Task[None]'] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def write(self, group_id: int, sender_id: int, text: str) -> ChatMessage:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._start(loop)
+        future: 'asyncio.Future[ChatMessage]' = loop.create_future()
+        row = {'group_id': group_id, 'sender_id': sender_id, 'text': text, 'created_date': datetime.utcnow()}
+        await self._queue.put((row, future, time.perf_counter()))
+        return await future
+
+    def _start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._queue = asyncio.Queue(self.batch_size * 10)
+        # a fresh context keeps the writer's statements out of the first
+        # sender's per-request query stats
+        self._task = contextvars.Context().run(loop.create_task, self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.delay
+            while len(batch) < self.batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch: List[Pending]) -> None:
+        started = time.perf_counter()
+        try:
+            messages = await self._insert([row for row, _, _ in batch])
+        except IntegrityError:
+            # e.g. the group was deleted meanwhile: retry row by row so only
+            # the offending senders get the error
+            for item in batch:
+                await self._flush_one(item)
+        except Exception as exc:
+            write_errors.inc(len(batch))
+            logger.exception('chat message batch failed')
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+        else:
+            for (_, future, queued), message in zip(batch, messages):
+                wait_seconds.observe(started - queued)
+                if not future.done():
+                    future.set_result(message)
+        batch_rows.observe(len(batch))
+        flush_seconds.observe(time.perf_counter() - started)
+
+    async def _flush_one(self, item: Pending) -> None:
+        row, future, _ = item
+        try:
+            message, = await self._insert([row])
+        except Exception as exc:
+            write_errors.inc()
+            if not future.done():
+                future.set_exception(exc)
+        else:
+            if not future.done():
+                future.set_result(message)
+
+    async def _insert(self, rows: List[dict]) -> List[ChatMessage]:
+        stmt = insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True)
+        async with self._session_factory() as db:
+            ids = (await db.scalars(stmt, rows)).all()
+            await db.commit()
+        return [ChatMessage(id=message_id, is_read=False, **row) for message_id, row in zip(ids, rows)]
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._queue.join()
+        self._task.cancel()
+        self._task = None
+
+
+message_writer = MessageWriter()
+metrics.gauge('chat_write_pending', message_writer.pending)
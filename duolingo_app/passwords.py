@@ -0,0 +1,73 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple, TypeVar
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from duolingo_app import metrics
+from duolingo_app.config import PASSWORD_BCRYPT_ROUNDS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_WORKERS
+
+# min == max == default: a stored hash with any other cost is rehashed on
+# the next successful login
+pwd_context = CryptContext(
+    schemes=['bcrypt'], deprecated='auto',
+    bcrypt__default_rounds=PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__max_rounds=PASSWORD_BCRYPT_ROUNDS,
+)
+
+# bcrypt releases the GIL while hashing, so threads are enough to keep the
+# event loop free and to use several cores
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='bcrypt')
+_pending = 0
+
+hash_seconds = metrics.histogram('password_hash_seconds')
+rejected = metrics.counter('password_pool_rejected_total')
+metrics.gauge('password_pool_pending', lambda: _pending)
+
+T = TypeVar('T')
+
+
+def _timed(fn: Callable[..., T], *args) -> T:
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        hash_seconds.observe(time.perf_counter() - started)
+
+
+async def _run(fn: Callable[..., T], *args) -> T:
+    global _pending
+    if _pending >= PASSWORD_HASH_MAX_PENDING:
+        rejected.inc()
+        raise HTTPException(detail='Too many sign-ins right now, try again shortly', status_code=503,
+                            headers={'Retry-After': '1'})
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, _timed, fn, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def hash_passwords(passwords: Sequence[str]) -> List[str]:
+    """Hash many passwords in parallel, in order.
+
+    At most one per pool thread is queued at a time, so sign-ins arriving
+    meanwhile wait behind a few hashes rather than the whole batch.
+    """
+    limit = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+
+    async def one(password: str) -> str:
+        async with limit:
+            return await hash_password(password)
+
+    return list(await asyncio.gather(*(one(password) for password in passwords)))
+
+
+async def verify_password(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """Check ``password``; the second item is a new hash to store when the cost changed."""
+    return await _run(pwd_context.verify_and_update, password, hashed)
@@ -0,0 +1,230 @@
+import json
+import logging
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+from duolingo_app import metrics
+from duolingo_app.config import (RATE_LIMIT_BACKEND, RATE_LIMIT_ENABLED, RATE_LIMIT_LOGIN_IP,
+                                 RATE_LIMIT_LOGIN_USERNAME, RATE_LIMIT_MAX_KEYS, RATE_LIMIT_REDIS_URL,
+                                 RATE_LIMIT_REFRESH_IP, RATE_LIMIT_REGISTER_IP, RATE_LIMIT_TRUST_FORWARDED,
+                                 RATE_LIMIT_WRITE_IP)
+
+logger = logging.getLogger('duolingo_app.rate_limit')
+
+rejected_ip = metrics.counter('rate_limit_rejected_ip_total')
+rejected_username = metrics.counter('rate_limit_rejected_username_total')
+backend_errors = metrics.counter('rate_limit_backend_errors_total')
+
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class Limit(NamedTuple):
+    """A token bucket: holds up to ``burst`` requests, refilled at ``rate`` per second."""
+    rate: float
+    burst: int
+
+    @classmethod
+    def parse(cls, spec: str) -> Optional['Limit']:
+        """``'10/minute'`` -> 10 requests at once, then one every 6 seconds; empty means unlimited."""
+        if not spec:
+            return None
+        count, _, period = spec.partition('/')
+        return cls(int(count) / _PERIODS[period.strip() or 'second'], int(count))
+
+
+class Rule(NamedTuple):
+    ip: Optional[Limit] = None
+    # keyed on the "username" field of the JSON body
+    username: Optional[Limit] = None
+
+
+# (method, path without trailing slash) -> limits
+ROUTES: Dict[Tuple[str, str], Rule] = {
+    ('POST', '/auth/login'): Rule(ip=Limit.parse(RATE_LIMIT_LOGIN_IP), username=Limit.parse(RATE_LIMIT_LOGIN_USERNAME)),
+    ('POST', '/auth/register'): Rule(ip=Limit.parse(RATE_LIMIT_REGISTER_IP)),
+    ('POST', '/auth/refresh'): Rule(ip=Limit.parse(RATE_LIMIT_REFRESH_IP)),
+}
+# every other write
+DEFAULT_WRITE = Rule(ip=Limit.parse(RATE_LIMIT_WRITE_IP))
+WRITE_METHODS = frozenset(('POST', 'PUT', 'PATCH', 'DELETE'))
+
+
+class Backend(ABC):
+    @abstractmethod
+    async def take(self, key: str, limit: Limit) -> float:
+        """Take one token from ``key``'s bucket: 0 if there was one, else seconds until there is."""
+
+
+class MemoryBackend(Backend):
+    """Buckets of this worker only; least recently used keys go first past ``maxsize``.
+
+    An evicted bucket comes back full, so the bound only needs to cover the
+    keys that are active within one refill period.
+    """
+
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_KEYS) -> None:
+        self.maxsize = maxsize
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def take(self, key: str, limit: Limit) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (limit.burst, now))
+        tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / limit.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+# same arithmetic as MemoryBackend, atomic on the server; idle buckets expire once full again
+_TAKE_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisBackend(Backend):
+    """Buckets shared by every worker through a Redis-protocol server (needs the optional redis package)."""
+
+    def __init__(self, url: str) -> None:
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError('RATE_LIMIT_BACKEND=redis needs the redis package: pip install redis')
+        self._client = redis.from_url(url)
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+
+    async def take(self, key: str, limit: Limit) -> float:
+        # wall clock, since the buckets are shared between processes
+        wait = await self._take(keys=[f'ratelimit:{key}'], args=[limit.rate, limit.burst, time.time()])
+        return float(wait)
+
+
+def create_backend(kind: str = RATE_LIMIT_BACKEND) -> Backend:
+    if kind == 'redis':
+        return RedisBackend(RATE_LIMIT_REDIS_URL)
+    if kind != 'memory':
+        raise ValueError(f'unknown RATE_LIMIT_BACKEND {kind!r}')
+    backend = MemoryBackend()
+    metrics.gauge('rate_limit_keys', backend.__len__)
+    return backend
+
+
+def _client_ip(scope) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope['headers']:
+            if name == b'x-forwarded-for':
+                # the last hop is the one our proxy appended
+                return value.decode('latin-1').rsplit(',', 1)[-1].strip()
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
+
+
+def _username(body: bytes) -> Optional[str]:
+    try:
+        username = json.loads(body).get('username')
+    except (ValueError, AttributeError):
+        return None
+    return username.lower() if isinstance(username, str) else None
+
+
+class RateLimitMiddleware:
+    """Token-bucket limits per client IP and, where configured, per username.
+
+    A plain ASGI middleware: allowed requests pass through untouched, and only
+    routes with a username limit have their body read (and then replayed to
+    the app). Rejections get 429 with Retry-After. If the backend fails the
+    request is let through, so an outage of a shared store does not take the
+    API down with it.
+    """
+
+    def __init__(self, app, backend: Optional[Backend] = None) -> None:
+        self.app = app
+        self.backend = backend or create_backend()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http' or not RATE_LIMIT_ENABLED:
+            return await self.app(scope, receive, send)
+        method, path = scope['method'], scope['path'].rstrip('/')
+        rule, bucket = ROUTES.get((method, path)), f'{method}:{path}'
+        if rule is None and method in WRITE_METHODS:
+            # one bucket for all of them, paths carry ids
+            rule, bucket = DEFAULT_WRITE, 'write'
+        if rule is None:
+            return await self.app(scope, receive, send)
+
+        if rule.ip is not None:
+            wait = await self._take(f'ip:{bucket}:{_client_ip(scope)}', rule.ip)
+            if wait:
+                rejected_ip.inc()
+                return await self._reject(send, wait)
+
+        if rule.username is not None:
+            body, receive = await self._read_body(receive)
+            username = _username(body)
+            if username is not None:
+                wait = await self._take(f'user:{bucket}:{username}', rule.username)
+                if wait:
+                    rejected_username.inc()
+                    return await self._reject(send, wait)
+
+        await self.app(scope, receive, send)
+
+    async def _take(self, key: str, limit: Limit) -> float:
+        try:
+            return await self.backend.take(key, limit)
+        except Exception:
+            backend_errors.inc()
+            logger.exception('rate limit backend failed, letting the request through')
+            return 0.0
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] != 'http.request':
+                # client went away; let the app see it
+                pending = [message]
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                pending = []
+                break
+        body = b''.join(chunks)
+        replay = [{'type': 'http.request', 'body': body, 'more_body': False}, *pending]
+
+        async def replay_receive():
+            if replay:
+                return replay.pop(0)
+            return await receive()
+
+        return body, replay_receive
+
+    @staticmethod
+    async def _reject(send, wait: float) -> None:
+        body = json.dumps({'detail': 'Too many requests'}).encode()
+        await send({'type': 'http.response.start', 'status': 429, 'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'retry-after', str(max(1, math.ceil(wait))).encode()),
+        ]})
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,121 @@
+import sys
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from duolingo_app import metrics
+from duolingo_app.config import CHAT_RECENT_MAX_BYTES, CHAT_RECENT_PER_GROUP
+
+hits = metrics.counter('chat_recent_hits_total')
+misses = metrics.counter('chat_recent_misses_total')
+
+# dict, ints and datetime of one message, on top of its text
+_MESSAGE_OVERHEAD = 600
+
+
+def _size(message: dict) -> int:
+    return _MESSAGE_OVERHEAD + sys.getsizeof(message['text'])
+
+
+class _Ring:
+    def __init__(self, messages: List[dict], complete: bool) -> None:
+        self.messages = messages
+        self.ids = [m['id'] for m in messages]
+        # True when the ring holds the group's whole history
+        self.complete = complete
+        self.size = sum(_size(m) for m in messages)
+
+
+class RecentMessages:
+    """The newest messages of recently active groups, kept in id order.
+
+    Each group holds at most ``per_group`` messages; groups are evicted least
+    recently used first once all rings together pass ``max_bytes``. A ring
+    only exists once the group's latest page was loaded from the database,
+    after which every new message is added to it (locally sent or arriving
+    through the broker), so the newest pages can be answered from memory.
+    """
+
+    def __init__(self, per_group: int = CHAT_RECENT_PER_GROUP, max_bytes: int = CHAT_RECENT_MAX_BYTES) -> None:
+        self.per_group = per_group
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._rings: 'OrderedDict[int, _Ring]' = OrderedDict()
+        # groups being loaded -> whether a message arrived meanwhile
+        self._loading: Dict[int, bool] = {}
+
+    def group_count(self) -> int:
+        return len(self._rings)
+
+    def page(self, group_id: int, limit: int, before_id: Optional[int] = None) -> Optional[List[dict]]:
+        """Up to ``limit`` newest messages (below ``before_id``), or None if memory cannot tell."""
+        ring = self._rings.get(group_id)
+        if ring is None:
+            misses.inc()
+            return None
+        end = len(ring.ids) if before_id is None else bisect_left(ring.ids, before_id)
+        if end < limit and not ring.complete:
+            misses.inc()
+            return None
+        self._rings.move_to_end(group_id)
+        hits.inc()
+        return ring.messages[max(0, end - limit):end]
+
+    def begin_load(self, group_id: int) -> None:
+        self._loading.setdefault(group_id, False)
+
+    def load(self, group_id: int, messages: List[dict], complete: bool) -> None:
+        """Install the latest page read from the database (oldest first).
+
+        Skipped if a message for the group arrived while the page was being
+        read, since the page may predate it.
+        """
+        if self._loading.pop(group_id, True) or group_id in self._rings:
+            return
+        ring = _Ring(messages[-self.per_group:], complete and len(messages) <= self.per_group)
+        self._rings[group_id] = ring
+        self.bytes += ring.size
+        self._evict()
+
+    def add(self, message: dict) -> None:
+        group_id = message['group_id']
+        if group_id in self._loading:
+            self._loading[group_id] = True
+        ring = self._rings.get(group_id)
+        if ring is None:
+            return
+        index = bisect_left(ring.ids, message['id'])
+        if index < len(ring.ids) and ring.ids[index] == message['id']:
+            return
+        ring.ids.insert(index, message['id'])
+        ring.messages.insert(index, message)
+        ring.size += _size(message)
+        self.bytes += _size(message)
+        if len(ring.ids) > self.per_group:
+            dropped = ring.messages.pop(0)
+            ring.ids.pop(0)
+            ring.size -= _size(dropped)
+            self.bytes -= _size(dropped)
+            ring.complete = False
+        self._rings.move_to_end(group_id)
+        self._evict()
+
+    def drop(self, group_id: int) -> None:
+        ring = self._rings.pop(group_id, None)
+        if ring is not None:
+            self.bytes -= ring.size
+
+    def clear(self) -> None:
+        self._rings.clear()
+        for group_id in self._loading:
+            self._loading[group_id] = True
+        self.bytes = 0
+
+    def _evict(self) -> None:
+        while self.bytes > self.max_bytes and self._rings:
+            _, ring = self._rings.popitem(last=False)
+            self.bytes -= ring.size
+
+
+recent_messages = RecentMessages()
+metrics.gauge('chat_recent_bytes', lambda: recent_messages.bytes)
+metrics.gauge('chat_recent_groups', recent_messages.group_count)
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, select
+from duolingo_app import metrics
+from duolingo_app.config import REFRESH_TOKEN_LIFETIME, REFRESH_TOKEN_SWEEP_BATCH, REFRESH_TOKEN_SWEEP_INTERVAL
+from duolingo_app.database.db import AsyncSessionLocal
+from duolingo_app.database.models import RefreshToken
+
+logger = logging.getLogger('duolingo_app.token_sweeper')
+
+swept = metrics.counter('auth_refresh_tokens_swept_total')
+
+
+async def sweep_expired_tokens(batch_size: int = REFRESH_TOKEN_SWEEP_BATCH) -> int:
+    """Delete refresh tokens older than their lifetime, ``batch_size`` rows per transaction.
+
+    Small batches keep each delete's locks and WAL short, so a large backlog
+    does not stall logins and refreshes touching the same table.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=REFRESH_TOKEN_LIFETIME)
+    expired = select(RefreshToken.id).where(RefreshToken.created_date < cutoff).limit(batch_size)
+    total = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            result = await db.execute(delete(RefreshToken).where(RefreshToken.id.in_(expired)))
+            await db.commit()
+            total += result.rowcount
+            if result.rowcount < batch_size:
+                break
+    swept.inc(total)
+    return total
+
+
+class TokenSweeper:
+    def __init__(self, interval: float = REFRESH_TOKEN_SWEEP_INTERVAL) -> None:
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                count = await sweep_expired_tokens()
+                if count:
+                    logger.info('deleted %d expired refresh tokens', count)
+            except Exception:
+                logger.exception('refresh token sweep failed')
+            await asyncio.sleep(self.interval)
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+token_sweeper = TokenSweeper()
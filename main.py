@@ -1,5 +1,10 @@
 import uvicorn
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from duolingo_app.database import query_stats
+from duolingo_app.message_writer import message_writer
+from duolingo_app.token_sweeper import token_sweeper
+from duolingo_app.rate_limit import RateLimitMiddleware
 from duolingo_app.api.chat_message import chat_router
 from duolingo_app.admin.setup import setup_admin
 
@@ -20,9 +25,21 @@ from duolingo_app.api import (
     review,
     paid_sub,
     invite,
-    auth,)
+    auth,
+    metrics,
+    message,)
 
-duolingo_app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    token_sweeper.start()
+    yield
+    await token_sweeper.close()
+    await message_writer.close()
+    await chat_message.manager.close()
+
+
+duolingo_app = FastAPI(lifespan=lifespan)
+duolingo_app.add_middleware(RateLimitMiddleware)
 duolingo_app.include_router(user.user_router)
 duolingo_app.include_router(user_progress.progress_router)
 duolingo_app.include_router(subcourse.sub_router)
@@ -42,8 +59,19 @@ duolingo_app.include_router(review.review_router)
 duolingo_app.include_router(paid_sub.paid_subscription_router)
 duolingo_app.include_router(invite.invited_friend_router)
 duolingo_app.include_router(auth.auth_router)
+duolingo_app.include_router(metrics.metrics_router)
+duolingo_app.include_router(message.message_router)
 
 setup_admin(duolingo_app)
 
+
+@duolingo_app.middleware('http')
+async def count_queries(request: Request, call_next):
+    with query_stats.track(f'{request.method} {request.url.path}') as stats:
+        response = await call_next(request)
+    response.headers['X-DB-Queries'] = str(stats.count)
+    response.headers['X-DB-Time-Ms'] = f'{stats.seconds * 1000:.1f}'
+    return response
+
 if __name__ == '__main__':
-    uvicorn.run(duolingo_app, host='127.0.0.1', port=8003)
\ No newline at end of file
+    uvicorn.run(duolingo_app, host='127.0.0.1', port=8003, ws_per_message_deflate=True)
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""composite indexes for hot queries
+
+Revision ID: 3f2a9c7d41b6
+Revises: 99cb11ebae43
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c7d41b6'
+down_revision: Union[str, Sequence[str], None] = '99cb11ebae43'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; if a build
+    # fails it leaves an INVALID index behind that has to be dropped by hand
+    with op.get_context().autocommit_block():
+        op.create_index('ix_message_group_id_id', 'message', ['group_id', sa.text('id DESC')],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_group_people_user_id_group_id', 'group_people', ['user_id', 'group_id'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_history_user_id_created_at', 'history', ['user_id', 'created_at'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_user_progress_user_id_completed', 'user_progress', ['user_id', 'completed'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_users_active_id', 'users', ['id'], unique=False,
+                        postgresql_where=sa.text('is_active'), postgresql_concurrently=True)
+        # each is a prefix of one of the composites above, so only costs writes now
+        op.drop_index('ix_message_group_id', table_name='message', postgresql_concurrently=True)
+        op.drop_index('ix_group_people_user_id', table_name='group_people', postgresql_concurrently=True)
+        op.drop_index('ix_history_user_id', table_name='history', postgresql_concurrently=True)
+        op.drop_index('ix_user_progress_user_id', table_name='user_progress', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('ix_user_progress_user_id', 'user_progress', ['user_id'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_history_user_id', 'history', ['user_id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_group_people_user_id', 'group_people', ['user_id'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_message_group_id', 'message', ['group_id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_users_active_id', table_name='users', postgresql_concurrently=True)
+        op.drop_index('ix_user_progress_user_id_completed', table_name='user_progress',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_history_user_id_created_at', table_name='history', postgresql_concurrently=True)
+        op.drop_index('ix_group_people_user_id_group_id', table_name='group_people',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_message_group_id_id', table_name='message', postgresql_concurrently=True)
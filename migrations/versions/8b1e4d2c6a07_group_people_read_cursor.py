@@ -0,0 +1,34 @@
+"""group_people read cursor
+
+Revision ID: 8b1e4d2c6a07
+Revises: 3f2a9c7d41b6
+Create Date: 2026-10-18 16:02:47.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1e4d2c6a07'
+down_revision: Union[str, Sequence[str], None] = '3f2a9c7d41b6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # nullable without a default: a metadata-only change, no table rewrite
+    op.add_column('group_people', sa.Column('last_read_message_id', sa.Integer(), nullable=True))
+    # existing members start caught up instead of with the whole history unread
+    op.execute(
+        'UPDATE group_people SET last_read_message_id = '
+        '(SELECT max(message.id) FROM message WHERE message.group_id = group_people.group_id)'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('group_people', 'last_read_message_id')
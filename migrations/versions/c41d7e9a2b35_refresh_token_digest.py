@@ -0,0 +1,49 @@
+"""refresh_token digest and rotation
+
+Revision ID: c41d7e9a2b35
+Revises: 8b1e4d2c6a07
+Create Date: 2026-10-18 16:44:09.271548
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7e9a2b35'
+down_revision: Union[str, Sequence[str], None] = '8b1e4d2c6a07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('refresh_token', sa.Column('token_hash', sa.String(length=64), nullable=True))
+    op.add_column('refresh_token', sa.Column('family', sa.String(length=32), nullable=True))
+    op.add_column('refresh_token', sa.Column('used', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+    # issued tokens keep working: hash them in place, each in a family of its own
+    op.execute(
+        "UPDATE refresh_token SET token_hash = encode(sha256(convert_to(token, 'UTF8')), 'hex'), "
+        "family = md5(id::text || random()::text)"
+    )
+    op.alter_column('refresh_token', 'token_hash', nullable=False)
+    op.alter_column('refresh_token', 'family', nullable=False)
+    op.create_index(op.f('ix_refresh_token_token_hash'), 'refresh_token', ['token_hash'], unique=True)
+    op.create_index(op.f('ix_refresh_token_family'), 'refresh_token', ['family'], unique=False)
+    op.create_index(op.f('ix_refresh_token_created_date'), 'refresh_token', ['created_date'], unique=False)
+    op.drop_column('refresh_token', 'token')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # the plain tokens cannot be recovered from their digests, so everyone logs in again
+    op.execute('DELETE FROM refresh_token')
+    op.add_column('refresh_token', sa.Column('token', sa.String(), nullable=False))
+    op.drop_index(op.f('ix_refresh_token_created_date'), table_name='refresh_token')
+    op.drop_index(op.f('ix_refresh_token_family'), table_name='refresh_token')
+    op.drop_index(op.f('ix_refresh_token_token_hash'), table_name='refresh_token')
+    op.drop_column('refresh_token', 'used')
+    op.drop_column('refresh_token', 'family')
+    op.drop_column('refresh_token', 'token_hash')
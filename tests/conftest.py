@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from duolingo_app.database.models import Base
+
+
+@pytest.fixture
+def session():
+    """A sync session on a fresh in-memory SQLite database, SAVEPOINTs included."""
+    engine = create_engine('sqlite://')
+
+    # pysqlite's own transaction handling gets in the way of SAVEPOINT
+    @event.listens_for(engine, 'connect')
+    def _connect(dbapi_conn, record):
+        dbapi_conn.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def _begin(conn):
+        conn.exec_driver_sql('BEGIN')
+
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
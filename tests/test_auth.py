@@ -0,0 +1,54 @@
+import sqlite3
+import asyncpg.exceptions
+from sqlalchemy.exc import IntegrityError
+from duolingo_app.api.auth import AuthUser, taken_field, user_cache
+from duolingo_app.database.models import UserProfile
+
+
+def _asyncpg_error(index: str, key: str, value: str) -> IntegrityError:
+    pg = asyncpg.exceptions.PostgresError.new({
+        'C': '23505',
+        'M': f'duplicate key value violates unique constraint "{index}"',
+        'D': f'Key ({key})=({value}) already exists.',
+        'n': index,
+    })
+    # what SQLAlchemy's asyncpg adapter raises: its own error, caused by asyncpg's
+    orig = Exception(f'{type(pg).__name__}: {pg}\nDETAIL:  {pg.detail}')
+    orig.__cause__ = pg
+    return IntegrityError('INSERT INTO users ...', {}, orig)
+
+
+def test_username_containing_email_is_reported_as_username():
+    assert taken_field(_asyncpg_error('ix_users_username', 'username', 'email_fan')) == 'username'
+
+
+def test_email_collision_on_postgres():
+    assert taken_field(_asyncpg_error('ix_users_email', 'email', 'ann@example.com')) == 'email address'
+
+
+def test_sqlite_messages():
+    for column, field in (('username', 'username'), ('email', 'email address')):
+        orig = sqlite3.IntegrityError(f'UNIQUE constraint failed: users.{column}')
+        assert taken_field(IntegrityError('INSERT INTO users ...', {}, orig)) == field
+
+
+def _user(username: str, email: str) -> UserProfile:
+    return UserProfile(username=username, first_name='A', last_name='B', email=email, password='-')
+
+
+def test_failed_savepoint_keeps_user_invalidation(session):
+    user = _user('ann', 'ann@example.com')
+    session.add(user)
+    session.commit()
+    user_cache.set(user.id, AuthUser(user.id, user.username))
+
+    user.is_active = False
+    session.flush()
+    try:
+        with session.begin_nested():
+            session.add(_user('ann', 'other@example.com'))
+    except IntegrityError:
+        pass
+    session.commit()
+
+    assert user_cache.get(user.id) is None
@@ -0,0 +1,72 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime
+from duolingo_app.broker import InProcessBroker, PostgresBroker
+
+
+def _pair():
+    hub = []
+    a, b = InProcessBroker(hub=hub), InProcessBroker(hub=hub)
+    got_a, got_b = [], []
+    a.subscribe(got_a.append)
+    b.subscribe(got_b.append)
+    return a, b, got_a, got_b
+
+
+def test_envelope_reaches_the_other_worker_only():
+    async def main():
+        a, b, got_a, got_b = _pair()
+        await b.start()
+        sent = datetime(2026, 1, 2, 3, 4, 5)
+        await a.publish({'user_ids': [1], 'payload': {'event': 'message', 'created_date': sent}})
+        return got_a, got_b, sent
+
+    got_a, got_b, sent = asyncio.run(main())
+    assert got_a == []
+    assert got_b == [{'user_ids': [1], 'payload': {'event': 'message', 'created_date': sent}}]
+
+
+def test_reconnect_sends_reset_once_connected():
+    async def main():
+        a, b, got_a, got_b = _pair()
+        await a.start()
+        await b.start()
+        a._connection_lost()
+        await a._reconnecting
+        await b.publish({'invalidate': 7})
+        return got_a, got_b
+
+    got_a, got_b = asyncio.run(main())
+    assert got_a == [{'reset': True}, {'invalidate': 7}]
+    assert got_b == []
+
+
+class _RecordingConnection:
+    def __init__(self) -> None:
+        self.payloads = []
+
+    async def execute(self, query, channel, payload):
+        self.payloads.append(payload)
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+def test_postgres_reassembles_chunked_payloads():
+    async def main():
+        sender, receiver = PostgresBroker('postgresql://-'), PostgresBroker('postgresql://-')
+        got = []
+        receiver.subscribe(got.append)
+        sender._conn = conn = _RecordingConnection()
+        envelope = {'user_ids': [1, 2], 'payload': {'text': 'ü' * PostgresBroker.CHUNK_BYTES}}
+        await sender._send(json.dumps({**envelope, 'origin': sender.node_id}))
+        await sender._send(json.dumps({'invalidate': 3, 'origin': sender.node_id}))
+        for payload in conn.payloads:
+            receiver._on_notify(None, 0, receiver.channel, payload)
+        return conn.payloads, got, envelope
+
+    payloads, got, envelope = asyncio.run(main())
+    assert len(payloads) > 2 and all(len(p.encode()) < 8000 for p in payloads)
+    assert got == [envelope, {'invalidate': 3}]
@@ -0,0 +1,40 @@
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from duolingo_app import catalog
+from duolingo_app.database.models import Course, Language, Lesson
+
+
+def _course(session: Session) -> Course:
+    course = Course(title='Basics', description='-', order=1, language=Language(language_name='English', code='en'))
+    session.add(course)
+    session.commit()
+    return course
+
+
+def test_failed_savepoint_keeps_earlier_catalog_writes(session):
+    course = _course(session)
+    seen = catalog.version
+
+    session.add(Lesson(title='one', order=1, course_id=course.id))
+    session.flush()
+    try:
+        with session.begin_nested():
+            # same order in the same course
+            session.add(Lesson(title='two', order=1, course_id=course.id))
+    except IntegrityError:
+        pass
+    session.commit()
+
+    assert catalog.version == seen + 1
+
+
+def test_rollback_forgets_catalog_writes(session):
+    course = _course(session)
+    seen = catalog.version
+
+    session.add(Lesson(title='one', order=1, course_id=course.id))
+    session.flush()
+    session.rollback()
+    session.commit()
+
+    assert catalog.version == seen
@@ -0,0 +1,44 @@
+import asyncio
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from duolingo_app.api.auth import AuthUser
+from duolingo_app.api.chat_message import mark_read
+from duolingo_app.database.models import Base, ChatGroup, GroupPeople, UserProfile
+
+
+def _pg_least(*args):
+    # Postgres LEAST/GREATEST skip NULLs, unlike SQLite's min()/max()
+    values = [a for a in args if a is not None]
+    return min(values) if values else None
+
+
+def _pg_greatest(*args):
+    values = [a for a in args if a is not None]
+    return max(values) if values else None
+
+
+async def _mark_read_in_empty_group(message_id: int) -> int:
+    engine = create_async_engine('sqlite+aiosqlite://')
+
+    @event.listens_for(engine.sync_engine, 'connect')
+    def _connect(dbapi_conn, record):
+        dbapi_conn.create_function('least', -1, _pg_least)
+        dbapi_conn.create_function('greatest', -1, _pg_greatest)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as db:
+        user = UserProfile(username='ann', first_name='A', last_name='B', email='ann@example.com', password='-')
+        group = ChatGroup(name='g', owner=user)
+        db.add(GroupPeople(group=group, user=user))
+        await db.flush()
+        me, group_id = AuthUser(user.id, user.username), group.id
+        await db.commit()
+        await mark_read(None, db, me, {'group_id': group_id, 'message_id': message_id})
+        cursor = await db.scalar(select(GroupPeople.last_read_message_id))
+    await engine.dispose()
+    return cursor
+
+
+def test_mark_read_in_empty_group_does_not_skip_future_messages():
+    assert asyncio.run(_mark_read_in_empty_group(10 ** 9)) == 0
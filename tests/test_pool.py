@@ -0,0 +1,41 @@
+import asyncio
+import sqlite3
+import pytest
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.util import greenlet_spawn
+from duolingo_app.database.pool import InstrumentedAsyncPool, checkout_timeouts
+
+
+def _checkout(pool: InstrumentedAsyncPool, times: int) -> None:
+    """Check out ``times`` connections at once, then return them."""
+    def checkout():
+        held = []
+        try:
+            for _ in range(times):
+                held.append(pool.connect())
+        finally:
+            for conn in held:
+                conn.close()
+
+    async def main():
+        await greenlet_spawn(checkout)
+    asyncio.run(main())
+
+
+def test_full_pool_counts_a_timeout():
+    pool = InstrumentedAsyncPool(lambda: sqlite3.connect(':memory:'), pool_size=1, max_overflow=0, timeout=0.01)
+    seen = checkout_timeouts.value
+    with pytest.raises(TimeoutError):
+        _checkout(pool, 2)
+    assert checkout_timeouts.value == seen + 1
+
+
+def test_connection_error_is_not_a_timeout():
+    def refuse():
+        raise ConnectionRefusedError('no database here')
+
+    pool = InstrumentedAsyncPool(refuse, pool_size=1, max_overflow=0, timeout=0.01)
+    seen = checkout_timeouts.value
+    with pytest.raises(ConnectionRefusedError):
+        _checkout(pool, 1)
+    assert checkout_timeouts.value == seen